@@ -24,6 +24,7 @@ which inherits from ConfigPrinter defines a seperate section of the configuratio
 """
 
 from .backend import parameters as fenics_params
+from .backend import has_krylov_solver_method
 
 import os
 import math
@@ -106,6 +107,13 @@ class ConfigParser(object):
             cpoint_dict = {}
         self.checkpointing = CheckpointCfg(**cpoint_dict)
 
+        # tlm_adjoint's multistage checkpointing needs the number of time steps
+        # in advance, which is not known with adaptive time stepping
+        assert not (self.checkpointing.method == "multistage"
+                    and self.time.adaptive_dt), \
+            "multistage checkpointing requires a fixed number of time steps: " \
+            "use 'memory' or 'periodic_disk' checkpointing with adaptive_dt"
+
         # Optional section for sampling prior and posterior
         try:
             sample_dict = self.config_dict['sample']
@@ -230,6 +238,20 @@ class InversionCfg(ConfigPrinter):
     use_cloud_point_velocities: bool = False
 
     mass_precon: bool = True
+
+    # Use the (row-sum) lumped mass matrix in the prior, so that M^-1 and
+    # M^1/2 are diagonal scalings
+    lumped_mass_prior: bool = False
+
+    # Solver for the prior operator in Prior.inv_action etc:
+    # 'cg' (CG/SOR), 'amg' (CG/AMG) or 'lu' (factorised once & reused)
+    prior_solver: str = "cg"
+
+    # Initial guess for the velocity at each L-BFGS function evaluation
+    # (converged velocity of last accepted iterate, optionally extrapolated)
+    warm_start: bool = False
+    warm_start_extrapolate: bool = False
+
     phase_name: str = 'inversion'
     phase_suffix: str = ''
 
@@ -251,6 +273,13 @@ class InversionCfg(ConfigPrinter):
         assert (self.ftol is not None) or (self.gtol is not None), \
             "Specify either 'ftol' or 'gtol' in inversion options"
 
+        assert self.warm_start or not self.warm_start_extrapolate, \
+            "warm_start_extrapolate requires warm_start"
+
+        assert self.prior_solver in ["cg", "amg", "lu"], \
+            f"Invalid prior_solver: {self.prior_solver}"
+
+
 @dataclass(frozen=True)
 class ObsCfg(ConfigPrinter):
     """
@@ -258,6 +287,8 @@ class ObsCfg(ConfigPrinter):
     """
     vel_file: str = None
     pts_len: float = None
+    cache_interp_operator: bool = False
+    interp_cache_dir: str = "obs_cache"
 
 @dataclass(frozen=True)
 class ErrorPropCfg(ConfigPrinter):
@@ -268,9 +299,19 @@ class ErrorPropCfg(ConfigPrinter):
     qoi_apply_vaf_mask: bool = False
     qoi_vaf_mask_usecode: bool = False
     qoi_vaf_mask_code: int = 1
+    sens_block_size: int = 0
     phase_name: str = 'error_prop'
     phase_suffix: str = ''
 
+    def __post_init__(self):
+        """
+        Sanity check the config
+
+        sens_block_size is the number of sensitivity times (dQ/dm) processed
+        together in run_errorprop; 0 means all of them at once.
+        """
+        assert self.sens_block_size >= 0
+
 
 @dataclass(frozen=True)
 class ObsSensCfg(ConfigPrinter):
@@ -313,6 +354,7 @@ class InvSigmaCfg(ConfigPrinter):
     """
     patch_downscale: float = None
     npatches: int = None
+    patch_block_size: int = 64  # Patch functionals per pass through the eigenvectors
     phase_name: str = 'inv_sigma'
     phase_suffix: str = ''
 
@@ -322,6 +364,7 @@ class InvSigmaCfg(ConfigPrinter):
             "Provide only one of npatches, patwnscale in [invsigma]"
         if self.npatches is None and self.patch_downscale is None:
             object.__setattr__(self, 'patch_downscale', 0.1)
+        assert self.patch_block_size >= 1
 
 @dataclass(frozen=True)
 class EigenDecCfg(ConfigPrinter):
@@ -331,6 +374,16 @@ class EigenDecCfg(ConfigPrinter):
     num_eig: int = None
     eig_algo: str = "slepc"
     power_iter: int = 1   #Number of power iterations for random algorithm
+    oversampling: int = 10  # Additional random vectors for random algorithm
+    hessian_block_size: int = 16  # Hessian actions per pass, random algorithm
+    restart: bool = False  # Resume (slepc) from previously converged eigenpairs
+    eigenvalue_thresh: float = 1.0e-1  # Eigenvalues below this are discarded in run_sample
+    stop_at_thresh: bool = False  # Stop (slepc) once eigenvalues fall below eigenvalue_thresh
+    trace_rtol: float = None  # Stop (slepc) once the posterior variance reduction saturates
+    ev_validation: str = "all"  # Check of eigenvectors on load: 'all', 'sample' or 'table'
+    ev_validation_samples: int = 10  # Eigenvectors checked for ev_validation = 'sample'
+    # MB per process for eigenvectors in the UQ phases (streamed if set)
+    ev_memory_budget: float = None
     misfit_only: bool = False
     precondition_by: str = "prior"
     test_ed: bool = False
@@ -346,6 +399,24 @@ class EigenDecCfg(ConfigPrinter):
         assert self.eig_algo in ["slepc", "random"], \
             "Valid selections for 'eig_algo' are 'slepc' or 'random'"
 
+        assert not (self.restart and self.eig_algo != "slepc"), \
+            "'restart' is only supported for eig_algo = 'slepc'"
+
+        assert self.trace_rtol is None or self.trace_rtol > 0.0
+
+        assert self.ev_validation in ["all", "sample", "table"], \
+            "Valid selections for 'ev_validation' are 'all', 'sample' or 'table'"
+        assert self.ev_validation_samples >= 1
+        assert self.ev_memory_budget is None or self.ev_memory_budget > 0.0
+
+        if self.eig_algo == "random":
+            assert self.num_eig is not None, \
+                "'num_eig' is required for eig_algo = 'random'"
+            assert self.power_iter >= 1
+            assert self.oversampling >= 0
+            assert self.hessian_block_size >= 1
+
+
 @dataclass(frozen=True)
 class ConstantsCfg(ConfigPrinter):
     """
@@ -427,21 +498,92 @@ class IceDynamicsCfg(ConfigPrinter):
 class MassSolveCfg(ConfigPrinter):
     """
     Options for mass balance solver
+
+    If reuse_solver is True, the thickness equation keeps its compiled forms,
+    assembled matrix (only re-assembled when its coefficients change) and
+    linear solver between time steps, so e.g. LU reuses its symbolic
+    factorisation. linear_solver may instead be a Krylov method (e.g. 'gmres',
+    with preconditioner), solved to relative tolerance krylov_rtol.
+
+    If explicit_thickness is True, the DG0 thickness is instead updated by an
+    explicit (forward Euler) upwind finite volume scheme, with each time step
+    split into as many substeps as needed to keep the CFL number (outflow
+    through cell boundaries per step, relative to cell area) below
+    explicit_cfl. Only the (diagonal) DG0 mass matrix is inverted.
     """
 
     use_cg_thickness: bool = False
+    explicit_thickness: bool = False
+    explicit_cfl: float = 0.5
+
+    reuse_solver: bool = False
+    linear_solver: str = "lu"
+    preconditioner: str = "default"
+    krylov_rtol: float = 1.0e-12
 
     def __post_init__(self):
-     """  """
+        """Check explicit thickness options"""
+        assert not (self.explicit_thickness and self.use_cg_thickness), \
+            "explicit_thickness requires DG0 thickness"
+        assert 0.0 < self.explicit_cfl <= 1.0
+
+    def solver_parameters(self):
+        """Linear solver parameters for the thickness equation"""
+        if not has_krylov_solver_method(self.linear_solver):
+            return {"linear_solver": self.linear_solver}
+        return {"linear_solver": self.linear_solver,
+                "preconditioner": self.preconditioner,
+                "krylov_solver": {"relative_tolerance": self.krylov_rtol,
+                                  "absolute_tolerance": 0.0,
+                                  "nonzero_initial_guess": True}}
 
 
 @dataclass(frozen=True)
 class MomsolveCfg(ConfigPrinter):
     """
     Configuration of MomentumSolver with sensible defaults for picard & newton params
+
+    If reuse_solver is True, the momentum equation, its compiled forms, the
+    assembled Jacobian (and sparsity pattern) and the linear solvers are kept
+    alive between calls to solve_mom_eq, and only re-assembled in place.
+
+    If adaptive_picard is True, the Picard stage hands over to Newton once
+    the residual has been reduced by a factor picard_switch_rtol, is skipped
+    entirely when the solve is warm started, and a failed Newton stage is
+    retried (up to newton_retries times) after further Picard iterations with
+    a tighter switch tolerance.
+
+    If inexact_newton is True, the relative tolerance of each Krylov solve is
+    set by Eisenstat-Walker (choice 2) forcing terms, i.e.
+    eta_k = ew_gamma * (|F_k| / |F_k-1|)**ew_alpha, starting from ew_eta0 and
+    bounded above by ew_eta_max & below by the krylov_solver relative_tolerance
+    of each stage (picard_params & newton_params respectively).
+    Defaults follow PETSc's SNESKSPSetParametersEW.
+
+    If reuse_preconditioner is True (and the linear solver is a Krylov method)
+    the preconditioner (e.g. hypre_amg hierarchy) is lagged across Newton
+    iterations, and across solves when reuse_solver is also True. It is only
+    rebuilt once the Krylov iteration count, per decade of residual
+    reduction, exceeds pc_rebuild_factor times that of the first solve after
+    the previous rebuild.
     """
 
     quadrature_degree: int = -1
+    reuse_solver: bool = False
+
+    adaptive_picard: bool = False
+    picard_switch_rtol: float = 1.0e-2
+    newton_retries: int = 2
+
+    inexact_newton: bool = False
+    ew_eta0: float = 0.3
+    ew_eta_max: float = 0.9
+    ew_gamma: float = 1.0
+    ew_alpha: float = 0.5 * (1.0 + math.sqrt(5.0))
+    ew_threshold: float = 0.1
+
+    reuse_preconditioner: bool = False
+    pc_rebuild_factor: float = 2.0
     picard_params: dict = field(default_factory=lambda: {
         'nonlinear_solver': 'newton',
         'newton_solver': {'linear_solver': 'cg',
@@ -466,6 +608,25 @@ class MomsolveCfg(ConfigPrinter):
                           'krylov_solver': {'absolute_tolerance': 1.0e-50,
                                             'relative_tolerance': 1.0e-8}}})
 
+    def __post_init__(self):
+        """Check adaptive & inexact nonlinear solver options"""
+        assert 0.0 < self.picard_switch_rtol < 1.0
+        assert self.newton_retries >= 0
+        assert 0.0 < self.ew_eta0 <= self.ew_eta_max < 1.0
+        assert 0.0 < self.ew_gamma <= 1.0
+        assert 1.0 < self.ew_alpha <= 2.0
+        assert self.pc_rebuild_factor > 1.0
+
+    def forcing_params(self):
+        """Eisenstat-Walker parameters for inexact Newton, or None if disabled"""
+        if not self.inexact_newton:
+            return None
+        return {'eta0': self.ew_eta0,
+                'eta_max': self.ew_eta_max,
+                'gamma': self.ew_gamma,
+                'alpha': self.ew_alpha,
+                'threshold': self.ew_threshold}
+
 
 @dataclass(frozen=True)
 class IOCfg(ConfigPrinter):
@@ -569,6 +730,20 @@ class TimeCfg(ConfigPrinter):
     num_sens: int = 1
     save_frequency: float = 0
 
+    # CFL-adaptive time stepping: dt above is the reference step length, and
+    # steps are dt * 2**k with dt_min <= step <= dt_max (default dt/16, 16*dt).
+    # Not supported with multistage checkpointing.
+    adaptive_dt: bool = False
+    cfl: float = 0.5
+    dt_min: float = None
+    dt_max: float = None
+
+    # Lagged momentum solves: velocity is re-solved every mom_solve_interval
+    # steps, or sooner if the relative (l2) change in thickness since the last
+    # solve exceeds mom_solve_dH_rtol. U_np is reused in between.
+    mom_solve_interval: int = 1
+    mom_solve_dH_rtol: float = None
+
     phase_name: str = 'forward'
     phase_suffix: str = ''
 
@@ -596,6 +771,16 @@ class TimeCfg(ConfigPrinter):
             object.__setattr__(self, 'total_steps', math.ceil(self.run_length/self.dt))
             object.__setattr__(self, 'steps_per_year', 1.0/self.dt)
 
+        if self.dt_min is None:
+            object.__setattr__(self, 'dt_min', self.dt / 16.0)
+        if self.dt_max is None:
+            object.__setattr__(self, 'dt_max', self.dt * 16.0)
+        assert 0.0 < self.dt_min <= self.dt <= self.dt_max
+        assert self.cfl > 0.0
+        assert self.mom_solve_interval >= 1
+        assert self.mom_solve_dH_rtol is None or self.mom_solve_dH_rtol > 0.0
+
+
 @dataclass(frozen=True)
 class CheckpointCfg(ConfigPrinter):
     """Configuration of checkpointing"""
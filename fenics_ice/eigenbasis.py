@@ -0,0 +1,313 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with fenics_ice.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Low-rank (eigenvector) basis W for the post-eigendecomposition phases, either
+stored as a single contiguous array of the locally owned degrees of freedom
+(EigenBasis) or streamed from the eigenvector file in blocks
+(StreamedEigenBasis)
+"""
+
+from .backend import Function, HDF5File, function_get_values, \
+    function_set_values, is_function, space_comm
+
+import logging
+import mpi4py.MPI as MPI  # noqa: N817
+import numpy as np
+
+log = logging.getLogger("fenics_ice")
+
+
+def _local_values(x):
+    """Locally owned values of a function or DOLFIN vector"""
+    if is_function(x):
+        return function_get_values(x)
+    return x.get_local()
+
+
+class EigenBasis:
+    """
+    A basis W = [w_0, ..., w_{k-1}] of functions in space
+
+    The local parts of the basis vectors are the rows of a (k, n_local) array,
+    so that W^T x and W c are each a single matrix-vector product (with one
+    MPI reduction for W^T x).
+    """
+
+    def __init__(self, space, values):
+        self.space = space
+        self.comm = space_comm(space)
+        self._W = np.ascontiguousarray(values, dtype=np.float64)
+        assert self._W.ndim == 2
+
+    @classmethod
+    def from_file(cls, space, filepath, n, reg_op=None, eps=None,
+                  validation="all", n_samples=10, norms=None):
+        """
+        Read the first n eigenvectors, v/vector_{i}, from an HDF5 file
+
+        If reg_op is supplied, the eigenvectors are checked as described in
+        validate.
+        """
+        w = Function(space)
+        values = None
+
+        with HDF5File(space_comm(space), str(filepath), 'r') as hdf5data:
+            for i in range(n):
+                hdf5data.read(w, f'v/vector_{i}')
+
+                w_local = function_get_values(w)
+                if values is None:
+                    values = np.empty((n, w_local.shape[0]), dtype=np.float64)
+                values[i, :] = w_local
+
+        if values is None:
+            values = np.empty((0, function_get_values(w).shape[0]),
+                              dtype=np.float64)
+
+        basis = cls(space, values)
+        if reg_op is not None:
+            basis.validate(reg_op, eps, validation=validation,
+                           n_samples=n_samples, norms=norms)
+        return basis
+
+    def validate(self, reg_op, eps, validation="all", n_samples=10,
+                 norms=None):
+        """
+        Check the basis vectors against the eigendecomposition
+
+        validation is one of:
+
+        'all'    : check that every basis vector has unit norm in the prior
+                   (to within eps). One prior action per basis vector.
+        'sample' : as 'all', but for n_samples randomly chosen basis vectors
+        'table'  : check the l2 norms of the basis vectors against those
+                   recorded by run_eigendec (norms), to within a relative eps.
+                   No prior actions. Falls back to 'sample' if there is no
+                   table.
+        """
+        n = len(self)
+        if validation == "table" and norms is None:
+            log.warning("No eigenvector norm table, validating a sample "
+                        "of the eigenvectors instead")
+            validation = "sample"
+
+        if validation == "table":
+            assert len(norms) >= n, "Eigenvector norm table is too short"
+            l2_norms = self.l2_norms()
+            assert np.all(np.abs(l2_norms - norms[:n]) <= eps * np.abs(norms[:n])), \
+                "Eigenvectors do not match the eigenvector norm table"
+            return
+
+        if validation == "sample" and n_samples < n:
+            indices = None
+            if self.comm.rank == 0:
+                indices = np.sort(np.random.choice(n, n_samples, replace=False))
+            indices = self.comm.bcast(indices, root=0)
+        else:
+            indices = range(n)
+
+        B_inv_w = Function(self.space, space_type="conjugate_dual")
+        for i in indices:
+            # Test squared norm in prior == 1.0
+            w = self.function(i)
+            reg_op.action(w.vector(), B_inv_w.vector())
+            norm_sq_in_prior = w.vector().inner(B_inv_w.vector())
+            assert (abs(norm_sq_in_prior - 1.0) < eps)
+
+        log.info(f"Checked the prior norm of {len(indices)} of {n} "
+                 "eigenvectors")
+
+    def l2_norms(self):
+        """The l2 norms of the basis vectors, as a NumPy array"""
+        local = np.einsum("ij,ij->i", self._W, self._W)
+        norms_sq = np.empty_like(local)
+        self.comm.Allreduce(local, norms_sq, op=MPI.SUM)
+        return np.sqrt(norms_sq)
+
+    def __len__(self):
+        return self._W.shape[0]
+
+    @property
+    def values(self):
+        """The (k, n_local) array of local basis vector values"""
+        return self._W
+
+    def subset(self, indices):
+        """A new EigenBasis of the basis vectors with the given indices"""
+        return EigenBasis(self.space, self._W[indices, :])
+
+    def function(self, i):
+        """Basis vector i as a new function"""
+        w = Function(self.space)
+        function_set_values(w, self._W[i, :])
+        return w
+
+    def inner(self, x):
+        """W^T x for a function or DOLFIN vector x, as a NumPy array"""
+        return self.inner_block(_local_values(x)[np.newaxis, :])[:, 0]
+
+    def inner_block(self, X):
+        """
+        W^T X for the (m, n_local) array X of local values of m vectors,
+        as a (k, m) array
+        """
+        local = self._W @ np.asarray(X, dtype=np.float64).T
+        WtX = np.empty_like(local)
+        self.comm.Allreduce(local, WtX, op=MPI.SUM)
+        return WtX
+
+    def combine(self, c, y=None):
+        """
+        Set the function y (by default a new function) to W c, and return it
+        """
+        if y is None:
+            y = Function(self.space)
+        function_set_values(y, self._W.T @ np.asarray(c, dtype=np.float64))
+        return y
+
+    def weighted_projection_block(self, X, d):
+        """
+        W^T X and W diag(d) W^T X for the (m, n_local) array X of local values
+        of m vectors, as a (k, m) array and an (m, n_local) array
+        """
+        WtX = self.inner_block(X)
+        return WtX, (self._W.T @ (np.asarray(d)[:, np.newaxis] * WtX)).T
+
+
+class StreamedEigenBasis(EigenBasis):
+    """
+    An EigenBasis which is not held in memory, but read from the eigenvector
+    file block_size basis vectors at a time, for each product with W or W^T
+
+    Each product is a pass through the file, so the memory required is
+    independent of the number of basis vectors.
+    """
+
+    def __init__(self, space, filepath, indices, block_size):
+        self.space = space
+        self.comm = space_comm(space)
+        self.filepath = str(filepath)
+        self._indices = np.asarray(indices, dtype=np.int64)
+        self.block_size = block_size
+        assert self.block_size >= 1
+
+        self._n_local = function_get_values(Function(space)).shape[0]
+
+    @classmethod
+    def from_file(cls, space, filepath, n, memory_budget, reg_op=None,
+                  eps=None, validation="all", n_samples=10, norms=None):
+        """
+        The first n eigenvectors, v/vector_{i}, of an HDF5 file, read in
+        blocks of at most memory_budget MB (per process)
+        """
+        n_local = function_get_values(Function(space)).shape[0]
+        block_size = max(1, int(memory_budget * 2 ** 20) // (8 * max(n_local, 1)))
+        # HDF5 reads are collective, so all processes use the same blocks
+        block_size = space_comm(space).allreduce(block_size, op=MPI.MIN)
+        log.info(f"Streaming {n} eigenvectors in blocks of {block_size}")
+
+        basis = cls(space, filepath, np.arange(n), block_size)
+        if reg_op is not None:
+            basis.validate(reg_op, eps, validation=validation,
+                           n_samples=n_samples, norms=norms)
+        return basis
+
+    def __len__(self):
+        return len(self._indices)
+
+    @property
+    def values(self):
+        raise NotImplementedError("A StreamedEigenBasis is not held in memory")
+
+    def subset(self, indices):
+        """A new StreamedEigenBasis of the basis vectors with the given indices"""
+        return StreamedEigenBasis(self.space, self.filepath,
+                                  self._indices[indices], self.block_size)
+
+    def function(self, i):
+        """Basis vector i as a new function"""
+        w = Function(self.space)
+        with HDF5File(self.comm, self.filepath, 'r') as hdf5data:
+            hdf5data.read(w, f'v/vector_{self._indices[i]}')
+        return w
+
+    def blocks(self):
+        """
+        Generator over (i0, W_b), where W_b is the (b, n_local) array of local
+        values of basis vectors i0, ..., i0 + b - 1
+        """
+        w = Function(self.space)
+        with HDF5File(self.comm, self.filepath, 'r') as hdf5data:
+            for i0 in range(0, len(self), self.block_size):
+                indices = self._indices[i0:i0 + self.block_size]
+                W_b = np.empty((len(indices), self._n_local), dtype=np.float64)
+                for j, i in enumerate(indices):
+                    hdf5data.read(w, f'v/vector_{i}')
+                    W_b[j, :] = function_get_values(w)
+                yield i0, W_b
+
+    def inner_block(self, X):
+        """
+        W^T X for the (m, n_local) array X of local values of m vectors,
+        as a (k, m) array
+        """
+        X = np.asarray(X, dtype=np.float64)
+        local = np.zeros((len(self), X.shape[0]), dtype=np.float64)
+        for i0, W_b in self.blocks():
+            local[i0:i0 + W_b.shape[0], :] = W_b @ X.T
+        WtX = np.empty_like(local)
+        self.comm.Allreduce(local, WtX, op=MPI.SUM)
+        return WtX
+
+    def combine(self, c, y=None):
+        """
+        Set the function y (by default a new function) to W c, and return it
+        """
+        c = np.asarray(c, dtype=np.float64)
+        y_local = np.zeros(self._n_local, dtype=np.float64)
+        for i0, W_b in self.blocks():
+            y_local += W_b.T @ c[i0:i0 + W_b.shape[0]]
+        if y is None:
+            y = Function(self.space)
+        function_set_values(y, y_local)
+        return y
+
+    def weighted_projection_block(self, X, d):
+        """
+        W^T X and W diag(d) W^T X for the (m, n_local) array X of local values
+        of m vectors, as a (k, m) array and an (m, n_local) array, in a single
+        pass through the file
+        """
+        X = np.asarray(X, dtype=np.float64)
+        d = np.asarray(d, dtype=np.float64)
+        WtX = np.empty((len(self), X.shape[0]), dtype=np.float64)
+        Y = np.zeros_like(X)
+        for i0, W_b in self.blocks():
+            i1 = i0 + W_b.shape[0]
+            self.comm.Allreduce(W_b @ X.T, WtX[i0:i1, :], op=MPI.SUM)
+            Y += (W_b.T @ (d[i0:i1, np.newaxis] * WtX[i0:i1, :])).T
+        return WtX, Y
+
+    def l2_norms(self):
+        """The l2 norms of the basis vectors, as a NumPy array"""
+        local = np.empty(len(self), dtype=np.float64)
+        for i0, W_b in self.blocks():
+            local[i0:i0 + W_b.shape[0]] = np.einsum("ij,ij->i", W_b, W_b)
+        norms_sq = np.empty_like(local)
+        self.comm.Allreduce(local, norms_sq, op=MPI.SUM)
+        return np.sqrt(norms_sq)
@@ -53,12 +53,14 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from .backend import HDF5File, XDMFFile, function_get_values, \
-    function_global_size, function_local_size, function_set_values, \
-    is_function, norm, project, space_comm, space_new
+from .backend import HDF5File, PETScVector, XDMFFile, as_backend_type, \
+    function_get_values, function_global_size, function_local_size, \
+    function_set_values, function_update_state, is_function, norm, project, \
+    space_comm, space_new
 
 import functools
 import logging
+import mpi4py.MPI as MPI  # noqa: N817
 import numpy as np
 from pathlib import Path
 import pickle
@@ -69,7 +71,8 @@ log = logging.getLogger("fenics_ice")
 
 __all__ = \
     [
-        "eigendecompose"
+        "eigendecompose",
+        "randomized_eigendecompose"
     ]
 
 
@@ -87,6 +90,18 @@ def flag_errors(fn):
     return wrapped_fn
 
 
+def petsc_vec(x):
+    """The PETSc Vec underlying a DOLFIN vector or function (not a copy)"""
+    if is_function(x):
+        x = x.vector()
+    return as_backend_type(x).vec()
+
+
+def dolfin_vector(x):
+    """A DOLFIN vector sharing the storage of the PETSc Vec x"""
+    return PETScVector(x)
+
+
 class PythonMatrix:
     def __init__(self, action, space):
         self._action = action
@@ -94,22 +109,32 @@ class PythonMatrix:
 
     @flag_errors
     def mult(self, A, x, y):
+        # Operate on x & y via DOLFIN wrappers of the PETSc Vecs. A new
+        # (ghosted) work function is used for each action, so that actions
+        # may be re-entrant.
         X = space_new(self._space)
-        with x.getBuffer(readonly=True) as x_a:
-            function_set_values(X, x_a)
+        X.vector().axpy(1.0, dolfin_vector(x))
+        X.vector().apply("insert")
+        function_update_state(X)
+
         y_a = self._action(X)
+        y = dolfin_vector(y)
         if is_function(y_a):
-            y_a = function_get_values(y_a)
+            y.zero()
+            y.axpy(1.0, y_a.vector())
+            return
         if not np.can_cast(y_a, PETSc.ScalarType):
             raise ValueError("Invalid dtype")
-        if y_a.shape != (y.getLocalSize(),):
+        if y_a.shape != (y.local_size(),):
             raise ValueError("Invalid shape")
-        y.setArray(y_a)
+        y.set_local(y_a)
+        y.apply("insert")
 
 
 def eigendecompose(space, A_action, B_matrix=None, N_eigenvalues=None,
                    solver_type=None, problem_type=None, which=None,
-                   tolerance=1.0e-12, max_it=1000000, configure=None, monitor=None):
+                   tolerance=1.0e-12, max_it=1000000, configure=None, monitor=None,
+                   deflation_space=None, stopping=None):
     # First written 2018-03-01
     """
     Matrix-free interface with SLEPc via slepc4py, loosely following
@@ -138,6 +163,13 @@ def eigendecompose(space, A_action, B_matrix=None, N_eigenvalues=None,
                    for manual configuration.
     monitor        (Optional) Function handle accepting the EPS. Can be used
                    for monitoring/outputting intermediate EVs.
+    deflation_space  (Optional) List of functions, e.g. previously converged
+                   eigenvectors. Eigenvectors are sought (B-)orthogonal to
+                   these.
+    stopping       (Optional) SLEPc stopping test, e.g. as returned by
+                   slepc_stopping_callback. If this stops the solver
+                   (EPS.ConvergedReason.CONVERGED_USER) fewer than
+                   N_eigenvalues eigenpairs may be returned.
 
     Returns:
 
@@ -181,24 +213,259 @@ def eigendecompose(space, A_action, B_matrix=None, N_eigenvalues=None,
     esolver.setTolerances(tol=tolerance, max_it=max_it)
     if configure is not None:
         configure(esolver)
+    if deflation_space is not None and len(deflation_space) > 0:
+        deflation_vecs = []
+        for V in deflation_space:
+            v = A_matrix.createVecRight()
+            petsc_vec(V).copy(v)
+            deflation_vecs.append(v)
+        esolver.setDeflationSpace(deflation_vecs)
     esolver.setUp()
 
     assert not _flagged_error[0]
 
     if monitor is not None:
         esolver.setMonitor(monitor)
+    if stopping is not None:
+        esolver.setStoppingTest(stopping)
 
     esolver.solve()
     if _flagged_error[0]:
         raise RuntimeError("Error encountered in SLEPc.EPS.solve")
-    if esolver.getConverged() < N_ev:
-        raise RuntimeError("Not all requested eigenpairs converged")
     if esolver.getConvergedReason() <= 0:
         raise RuntimeError("Convergence failure")
+    if esolver.getConverged() < N_ev \
+            and esolver.getConvergedReason() != SLEPc.EPS.ConvergedReason.CONVERGED_USER:
+        raise RuntimeError("Not all requested eigenpairs converged")
 
     return esolver
 
 
+def randomized_eigendecompose(space, A_action, B_action, B_inv_action,
+                              N_eigenvalues, oversampling=10, n_power_iter=1,
+                              seed=None):
+    """
+    Randomised double pass algorithm for the generalised Hermitian
+    eigenproblem
+
+        A v = lambda B v,
+
+    following Saibaba, Lee & Kitanidis, Numer. Linear Algebra Appl. 23 (2016),
+    Algorithm 6 (with Halko et al. style power iterations). The eigenvectors
+    are B-orthonormal.
+
+    Arguments:
+
+    space          Eigenvector space.
+    A_action       Callable accepting a list of functions and returning a list
+                   of functions or NumPy arrays, defining the action of the
+                   left-hand-side matrix on a block of vectors.
+    B_action       Callable B_action(x, y) computing y = B x for DOLFIN
+                   vectors, e.g. Prior.action.
+    B_inv_action   Callable B_inv_action(x, y) computing y = B^{-1} x, e.g.
+                   Prior.inv_action.
+    N_eigenvalues  Number of eigenvalues to find.
+    oversampling   (Optional) Number of additional random vectors.
+    n_power_iter   (Optional) Number of applications of B^{-1} A in the range
+                   finder (1 for the standard double pass algorithm).
+    seed           (Optional) Random seed.
+
+    Returns:
+
+    (lam, vr) the N_eigenvalues largest eigenvalues, in descending order, and
+    a list of corresponding eigenvector functions.
+    """
+    comm = space_comm(space)
+    X = space_new(space)
+    n, N = function_local_size(X), function_global_size(X)
+    del X
+    n_samples = min(N_eigenvalues + oversampling, N)
+    if N_eigenvalues > n_samples:
+        raise ValueError("Too many eigenvalues requested")
+
+    def as_functions(Y):
+        fns = []
+        for j in range(Y.shape[1]):
+            F = space_new(space)
+            function_set_values(F, np.ascontiguousarray(Y[:, j]))
+            fns.append(F)
+        return fns
+
+    def apply_A(Y):
+        AY = np.empty_like(Y)
+        for j, y in enumerate(A_action(as_functions(Y))):
+            AY[:, j] = function_get_values(y) if is_function(y) else y
+        return AY
+
+    def apply_vector_action(action, Y):
+        Z = np.empty_like(Y)
+        x, z = space_new(space), space_new(space)
+        for j in range(Y.shape[1]):
+            function_set_values(x, np.ascontiguousarray(Y[:, j]))
+            action(x.vector(), z.vector())
+            Z[:, j] = function_get_values(z)
+        return Z
+
+    def gram(Y, Z):
+        G = np.empty((Y.shape[1], Z.shape[1]), dtype=np.float64)
+        comm.Allreduce(np.ascontiguousarray(Y.T @ Z), G, op=MPI.SUM)
+        return G
+
+    def B_orthonormalize(Y):
+        # Two passes of (eigenvalue based) Cholesky QR in the B inner product,
+        # discarding numerically rank deficient directions
+        for i in range(2):
+            G = gram(Y, apply_vector_action(B_action, Y))
+            G = 0.5 * (G + G.T)
+            s, U = np.linalg.eigh(G)
+            keep = s > s.max() * np.finfo(np.float64).eps * G.shape[0]
+            Y = Y @ (U[:, keep] / np.sqrt(s[keep]))
+        return Y
+
+    rng = np.random.default_rng(None if seed is None else [seed, comm.rank])
+    Q = rng.standard_normal((n, n_samples))
+
+    # Range finder
+    for i in range(max(1, n_power_iter)):
+        if i > 0:
+            Q = B_orthonormalize(Q)
+        log.info(f"Randomised eigendecomposition: range finder pass {i + 1}")
+        Q = apply_vector_action(B_inv_action, apply_A(Q))
+    Q = B_orthonormalize(Q)
+    if Q.shape[1] < N_eigenvalues:
+        raise RuntimeError("Randomised eigendecomposition: numerical range "
+                           "smaller than the number of requested eigenvalues")
+
+    # Second pass: Rayleigh-Ritz
+    log.info("Randomised eigendecomposition: Rayleigh-Ritz pass")
+    T = gram(Q, apply_A(Q))
+    T = 0.5 * (T + T.T)
+    lam, S = np.linalg.eigh(T)
+    order = np.argsort(lam)[::-1][:N_eigenvalues]
+    lam, S = lam[order], S[:, order]
+
+    vr = as_functions(Q @ S)
+    for V_r in vr:
+        V_r.rename("ev", "")
+    return lam, vr
+
+
+def eigendec_output_paths(params):
+    """Paths of the eigenvector HDF5 & XDMF files and the eigenvalue pickle"""
+    eigenvecs_file = params.io.eigenvecs_file
+    eigenvalue_file = params.io.eigenvalue_file
+    phase_suffix = params.eigendec.phase_suffix
+    if len(phase_suffix) > 0:
+        eigenvecs_file = params.io.run_name + phase_suffix + '_vr.h5'
+        eigenvalue_file = params.io.run_name + phase_suffix + '_eigvals.p'
+
+    phase_name = params.eigendec.phase_name
+    outdir = Path(params.io.output_dir) / phase_name / phase_suffix
+    diagdir = Path(params.io.diagnostics_dir) / phase_name / phase_suffix
+    ev_filepath = outdir / eigenvecs_file
+    p = diagdir / eigenvecs_file
+    ev_xdmf_filepath = Path(p).parent / Path(p.stem + "_vis").with_suffix(".xdmf")
+    lam_file = outdir / eigenvalue_file
+
+    return ev_filepath, ev_xdmf_filepath, lam_file
+
+
+def ev_norms_filepath(params):
+    """
+    Path of the eigenvector norm table, the l2 norms of the eigenvectors as
+    written, against which the UQ phases may check the eigenvectors on load
+    """
+    ev_filepath, _, _ = eigendec_output_paths(params)
+    return ev_filepath.with_name(ev_filepath.stem + "_norms.p")
+
+
+def ev_l2_norm(V_r):
+    """l2 norm of the eigenvector V_r, as recorded in the norm table"""
+    return V_r.vector().norm("l2")
+
+
+def write_ev_norms(params, ev_norms):
+    """Write the eigenvector norm table"""
+    with open(ev_norms_filepath(params), "wb") as pfile:
+        pickle.dump(np.asarray(ev_norms, dtype=np.float64), pfile)
+
+
+def read_ev_norms(params):
+    """Read the eigenvector norm table, or None if there isn't one"""
+    norms_file = ev_norms_filepath(params)
+    if not norms_file.is_file():
+        return None
+    with open(norms_file, "rb") as pfile:
+        return pickle.load(pfile)
+
+
+def read_eigendecomposition(params, space):
+    """
+    Read the eigenpairs written so far (e.g. by slepc_monitor_callback before
+    the job was killed)
+
+    Returns (lam, vr) for the leading eigenpairs with a recorded eigenvalue
+    (at most params.eigendec.num_eig of them), or empty results if there are
+    none.
+    """
+    ev_filepath, _, lam_file = eigendec_output_paths(params)
+    if not (lam_file.is_file() and ev_filepath.is_file()):
+        return np.zeros(0, dtype=np.float64), []
+
+    with open(lam_file, "rb") as pfile:
+        lam = pickle.load(pfile)[0].real.astype(np.float64)
+    n_conv = np.argmax(np.isnan(lam)) if np.any(np.isnan(lam)) else len(lam)
+    if params.eigendec.num_eig is not None:
+        n_conv = min(n_conv, params.eigendec.num_eig)
+    lam = lam[:n_conv]
+
+    vr = []
+    with HDF5File(space.mesh().mpi_comm(), str(ev_filepath), 'r') as ev_file:
+        for i in range(n_conv):
+            V_r = space_new(space)
+            ev_file.read(V_r, f'v/vector_{i}')
+            V_r.rename("ev", "")
+            vr.append(V_r)
+
+    return lam, vr
+
+
+def write_eigenvalues(params, lam, lam_file):
+    """Write the eigenvalue pickle file"""
+    with open(lam_file, "wb") as pfile:
+        pickle.dump([lam,
+                     params.eigendec.num_eig,
+                     params.eigendec.power_iter,
+                     params.eigendec.eig_algo,
+                     params.eigendec.misfit_only,
+                     params.io.output_dir,
+                     params.io.input_dir], pfile)
+
+
+def write_eigendecomposition(params, space, lam, vr):
+    """
+    Write eigenvalues & eigenvectors in the same format as
+    slepc_monitor_callback
+    """
+    ev_filepath, ev_xdmf_filepath, lam_file = eigendec_output_paths(params)
+    comm = space.mesh().mpi_comm()
+
+    ev_xdmf_file = XDMFFile(comm, str(ev_xdmf_filepath))
+    ev_xdmf_file.parameters["rewrite_function_mesh"] = False
+    ev_xdmf_file.parameters["functions_share_mesh"] = True
+
+    ev_file = HDF5File(comm, str(ev_filepath), 'w')
+    for i, V_r in enumerate(vr):
+        ev_file.write(V_r, 'v', i)
+        ev_xdmf_file.write(V_r, i)
+    ev_file.parameters.add("num_eig", len(vr))
+    ev_file.close()
+    ev_xdmf_file.close()
+
+    write_eigenvalues(params, lam, lam_file)
+    write_ev_norms(params, [ev_l2_norm(V_r) for V_r in vr])
+
+
 def test_eigendecomposition(esolver, results, space, params):
     """Check the consistency of the eigendecomposition"""
 
@@ -257,11 +524,72 @@ def slepc_config_callback(prior_action, space, prior_pc):
     return inner_fn
 
 
-def slepc_monitor_callback(params, space, result_list):
+def early_stop_reached(lam, eigenvalue_thresh=None, trace_rtol=None):
+    """
+    Whether eigenvalues lam (in descending order) are sufficient:
+
+    eigenvalue_thresh : the smallest eigenvalue has fallen below this
+    trace_rtol        : the contribution lam / (1 + lam) of the smallest
+                        eigenvalue to the posterior variance reduction (the
+                        trace of W D W^T in the prior norm), relative to the
+                        total so far, has fallen below this
+    """
+    if len(lam) == 0:
+        return False
+    lam_min = lam[-1]
+
+    if eigenvalue_thresh is not None and lam_min < eigenvalue_thresh:
+        return True
+
+    if trace_rtol is not None:
+        reduction = np.maximum(lam, 0.0) / (1.0 + np.maximum(lam, 0.0))
+        if reduction[-1] <= trace_rtol * reduction.sum():
+            return True
+
+    return False
+
+
+def slepc_stopping_callback(params, lam_prev=()):
+    """
+    Closure which defines a slepc stopping test, terminating the
+    eigendecomposition early once the converged eigenvalues (appended to
+    any previously converged lam_prev) satisfy the eigendec.stop_at_thresh
+    or eigendec.trace_rtol criteria (see early_stop_reached)
+    """
+    import slepc4py.SLEPc as SLEPc
+
+    eigenvalue_thresh = params.eigendec.eigenvalue_thresh \
+        if params.eigendec.stop_at_thresh else None
+    trace_rtol = params.eigendec.trace_rtol
+    lam_prev = np.asarray(lam_prev, dtype=np.float64)
+
+    def inner_fn(eps, its, max_it, nconv, nev):
+        if nconv >= nev:
+            return SLEPc.EPS.ConvergedReason.CONVERGED_TOL
+        if its >= max_it:
+            return SLEPc.EPS.ConvergedReason.DIVERGED_ITS
+
+        lam = np.concatenate((lam_prev,
+                              [eps.getEigenvalue(i).real for i in range(nconv)]))
+        if nconv > 0 and early_stop_reached(lam, eigenvalue_thresh, trace_rtol):
+            log.info(f"Stopping eigendecomposition with {len(lam)} eigenpairs, "
+                     f"smallest eigenvalue {lam[-1]}")
+            return SLEPc.EPS.ConvergedReason.CONVERGED_USER
+
+        return SLEPc.EPS.ConvergedReason.ITERATING
+
+    return inner_fn
+
+
+def slepc_monitor_callback(params, space, result_list, restart=None):
     """
     Closure which defines the slepc monitor callback
 
     This allows keeping and modifying non-local variables, params etc
+
+    restart is an optional (lam, vr) of previously converged eigenpairs (see
+    read_eigendecomposition), which are kept, with the newly converged
+    eigenpairs appended.
     """
     nconv_prev = 0
 
@@ -275,20 +603,20 @@ def slepc_monitor_callback(params, space, result_list):
     # Setup result dictionary
     result_list["lam"] = np.full(num_eig, np.NAN, dtype=np.float64)
     result_list["vr"] = []
+    ev_norms = []
 
-    # Open results files
-    eigenvecs_file = params.io.eigenvecs_file
-    phase_suffix = params.eigendec.phase_suffix
-    if len(phase_suffix) > 0:
-        eigenvecs_file = params.io.run_name + phase_suffix + '_vr.h5'
+    lam_prev, vr_prev = restart if restart is not None else ([], [])
+    n_prev = min(len(vr_prev), num_eig)
+    lam_prev, vr_prev = lam_prev[:n_prev], vr_prev[:n_prev]
+    result_list["lam"][:n_prev] = lam_prev
+    result_list["vr"].extend(vr_prev)
+    ev_norms.extend(ev_l2_norm(V_r) for V_r in vr_prev)
 
-    outdir = Path(params.io.output_dir)/params.eigendec.phase_name/params.eigendec.phase_suffix
-    diagdir = Path(params.io.diagnostics_dir)/params.eigendec.phase_name/params.eigendec.phase_suffix
-    ev_filepath = outdir / eigenvecs_file
+    # Open results files
+    ev_filepath, ev_xdmf_filepath, lam_file = eigendec_output_paths(params)
     # Delete files to avoid append
-    ev_filepath.unlink(missing_ok=True)
-    p = diagdir / eigenvecs_file
-    ev_xdmf_filepath = Path(p).parent / Path(p.stem + "_vis").with_suffix(".xdmf")
+    if n_prev == 0:
+        ev_filepath.unlink(missing_ok=True)
 
     ev_xdmf_file = XDMFFile(space.mesh().mpi_comm(), str(ev_xdmf_filepath))
     ev_xdmf_file.parameters["rewrite_function_mesh"] = False
@@ -296,14 +624,27 @@ def slepc_monitor_callback(params, space, result_list):
     ev_xdmf_file.parameters["flush_output"] = True
 
     # Open and close files to ensure they are clear for future appends
-    ev_file = HDF5File(space.mesh().mpi_comm(), str(ev_filepath), 'w')
-    ev_file.close()
-
-    eigenvalue_file = params.io.eigenvalue_file
-    phase_suffix = params.eigendec.phase_suffix
-    if len(phase_suffix) > 0:
-        eigenvalue_file = params.io.run_name + phase_suffix + '_eigvals.p'
-    lam_file = outdir / eigenvalue_file
+    if n_prev == 0:
+        ev_file = HDF5File(space.mesh().mpi_comm(), str(ev_filepath), 'w')
+        ev_file.close()
+    else:
+        # New eigenvectors are appended as v/vector_{count}, so the file must
+        # hold exactly the n_prev previous eigenvectors (it may hold more if
+        # the previous job died between writing eigenvectors & eigenvalues)
+        with HDF5File(space.mesh().mpi_comm(), str(ev_filepath), 'r') as ev_file:
+            count = ev_file.attributes('v')['count'] if ev_file.has_dataset('v') else 0
+        if count != n_prev:
+            log.info(f"Rewriting {ev_filepath} with {n_prev} of its {count} "
+                     "eigenvectors")
+            ev_file = HDF5File(space.mesh().mpi_comm(), str(ev_filepath), 'w')
+            for i, V_r in enumerate(vr_prev):
+                ev_file.write(V_r, 'v', i)
+            ev_file.parameters.add("num_eig", n_prev)
+            ev_file.close()
+        write_eigenvalues(params, result_list["lam"], lam_file)
+        write_ev_norms(params, ev_norms)
+    for i, V_r in enumerate(vr_prev):
+        ev_xdmf_file.write(V_r, i)
 
     V_r_prev = None
 
@@ -319,18 +660,19 @@ def slepc_monitor_callback(params, space, result_list):
 
         ev_file = HDF5File(space.mesh().mpi_comm(), str(ev_filepath), 'a')
 
-        for i in range(nconv_prev, min(nconv, num_eig)):
+        for i in range(nconv_prev, min(nconv, num_eig - n_prev)):
             V_r = space_new(space)
             v_r = A_matrix.getVecRight()
             lam_i = eps.getEigenpair(i, v_r)
 
-            result_list["lam"][i] = lam_i.real
+            result_list["lam"][n_prev + i] = lam_i.real
             with v_r.getBuffer(readonly=True) as v_rr:
                 function_set_values(V_r, v_rr)
             V_r.rename("ev", "")
             result_list["vr"].append(V_r)
-            ev_file.write(V_r, 'v', i)
-            ev_xdmf_file.write(V_r, i)
+            ev_norms.append(ev_l2_norm(V_r))
+            ev_file.write(V_r, 'v', n_prev + i)
+            ev_xdmf_file.write(V_r, n_prev + i)
             # for v, name in zip((V_r.sub(0), V_r.sub(1)), ['va', 'vb']):
             #     # ev_xdmf_file.write_checkpoint(v, name, i, append=True)
             #     v.rename(name, '')
@@ -338,17 +680,10 @@ def slepc_monitor_callback(params, space, result_list):
 
         # Note: here we rewrite this pickle file every time, but given
         # the small amount of data, that's probably OK.
-        pfile = open(lam_file, "wb")
-        pickle.dump([result_list["lam"],
-                     params.eigendec.num_eig,
-                     params.eigendec.power_iter,
-                     params.eigendec.eig_algo,
-                     params.eigendec.misfit_only,
-                     params.io.output_dir,
-                     params.io.input_dir], pfile)
-        pfile.close()
+        write_eigenvalues(params, result_list["lam"], lam_file)
+        write_ev_norms(params, ev_norms)
 
-        ev_file.parameters.add("num_eig", nconv)
+        ev_file.parameters.add("num_eig", n_prev + nconv)
         # ev_file.parameters.add("eig_algo", eig_algo)
         # ev_file.parameters.add("timestamp", str(datetime.datetime.now()))
 
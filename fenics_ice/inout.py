@@ -206,9 +206,12 @@ def gen_path(params, name, suffix, phase_suffix=''):
     return outdir/outfname
 
 
-def write_qval(Qval, params):
+def write_qval(Qval, params, ts=None):
     """
     Produces pickle dump with QOI value through time
+
+    ts are the times of the QOI values, by default those of
+    params.time.total_steps uniform time steps.
     """
 
     outdir = params.io.output_dir
@@ -219,15 +222,59 @@ def write_qval(Qval, params):
     if len(phase_suffix) > 0:
         filename = params.io.run_name + phase_suffix + '_Qval_ts.p'
 
-    run_length = params.time.run_length
-    n_steps = params.time.total_steps
-    ts = np.linspace(0, run_length, n_steps+1)
+    if ts is None:
+        run_length = params.time.run_length
+        n_steps = params.time.total_steps
+        ts = np.linspace(0, run_length, n_steps+1)
 
     outdir_final = Path(outdir)/phase_name/phase_suffix
 
     with open(outdir_final/filename, 'wb') as pickle_file:
         pickle.dump([Qval, ts], pickle_file)
 
+
+def interp_cache_path(params, key, comm):
+    """Path of this process's cached observation interpolation operator"""
+    cache_dir = Path(params.io.output_dir) / params.obs.interp_cache_dir
+    return cache_dir / f"interp_{key}_{comm.size}_{comm.rank}.npz"
+
+
+def read_interp_operator(params, key, comm):
+    """
+    Read a cached observation interpolation operator
+
+    Returns (obs_local, P), or None unless the operator is cached for
+    every process.
+    """
+    fpath = interp_cache_path(params, key, comm)
+    found = comm.allreduce(fpath.is_file(), op=MPI.LAND)
+    if not found:
+        return None
+
+    from scipy.sparse import csr_matrix
+    with np.load(fpath) as data:
+        obs_local = np.unpackbits(data["obs_local"],
+                                  count=int(data["n_obs"])).astype(bool)
+        P = csr_matrix((data["data"], data["indices"], data["indptr"]),
+                       shape=tuple(data["shape"]))
+    return obs_local, P
+
+
+def write_interp_operator(params, key, comm, obs_local, P):
+    """Cache an observation interpolation operator (sparse, compressed)"""
+    fpath = interp_cache_path(params, key, comm)
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+
+    P = P.tocsr()
+    tmp_path = fpath.with_suffix(".tmp.npz")
+    np.savez_compressed(tmp_path,
+                        data=P.data, indices=P.indices, indptr=P.indptr,
+                        shape=np.array(P.shape),
+                        obs_local=np.packbits(obs_local),
+                        n_obs=len(obs_local))
+    tmp_path.replace(fpath)
+
+
 def write_dqval(dQ_ts, cntrl_names, params):
     """
     Produces .pvd & .h5 files with dQoi_dCntrl
@@ -748,6 +795,7 @@ def configure_tlm_checkpointing(params):
     method = cparam.method
 
     if method == 'multistage':
+        # Not with adaptive_dt (see ConfigParser.parse)
         n_steps = params.time.total_steps
         config_dict = {"blocks": n_steps,
                        "snaps_on_disk": cparam.snaps_on_disk,
@@ -0,0 +1,210 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Vectorised location of (e.g. observation) points in the cells of a mesh.
+
+A PointLocator bins the local cells of a triangular mesh into a uniform grid
+of buckets (by bounding box), and locates a batch of points by testing the
+barycentric coordinates of each point against every candidate cell in its
+bucket, all with NumPy array operations. Locators, and the results of
+locating a given set of points, are cached per mesh.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import mpi4py.MPI as MPI  # noqa: N817
+import numpy as np
+
+log = logging.getLogger("fenics_ice")
+
+# Maximum number of meshes, and point sets per mesh, for which results are cached
+_CACHE_SIZE = 4
+
+_locators = OrderedDict()
+
+
+class PointLocator:
+    """
+    Spatial index of the locally owned cells of a 2D triangular mesh
+
+    Ghost cells are excluded, so that a point is only located by the
+    processes which own a cell containing it.
+    """
+
+    def __init__(self, mesh, tolerance=1.0e-12, chunk_size=100000):
+        if mesh.topology().dim() != 2 or mesh.geometry().dim() != 2:
+            raise NotImplementedError("PointLocator requires a 2D triangular mesh")
+
+        self.tolerance = tolerance
+        self.chunk_size = chunk_size
+        self._results = OrderedDict()
+
+        coords = mesh.coordinates()
+        n_owned = mesh.topology().ghost_offset(mesh.topology().dim())
+        cells = np.asarray(mesh.cells()[:n_owned], dtype=np.int64)
+        assert cells.shape[1] == 3
+        n_cells = cells.shape[0]
+        self.n_cells = n_cells
+
+        vertices = coords[cells]  # (n_cells, 3, 2)
+        self._v0 = vertices[:, 0, :]
+
+        # Inverse of the affine map from the reference triangle, for
+        # barycentric coordinates
+        T = np.stack((vertices[:, 1, :] - self._v0,
+                      vertices[:, 2, :] - self._v0), axis=2)
+        self._T_inv = np.linalg.inv(T) if n_cells > 0 else T
+
+        # Uniform grid of roughly one cell per bucket
+        cell_min = vertices.min(axis=1) if n_cells > 0 else np.zeros((0, 2))
+        cell_max = vertices.max(axis=1) if n_cells > 0 else np.zeros((0, 2))
+        self._lo = cell_min.min(axis=0) if n_cells > 0 else np.zeros(2)
+        hi = cell_max.max(axis=0) if n_cells > 0 else np.ones(2)
+        extent = np.maximum(hi - self._lo, np.finfo(np.float64).tiny)
+        n_buckets = max(1, n_cells)
+        aspect = extent[0] / extent[1]
+        nx = int(np.clip(np.round(np.sqrt(n_buckets * aspect)), 1, n_buckets))
+        ny = int(np.clip(np.round(n_buckets / nx), 1, n_buckets))
+        self._shape = np.array([nx, ny], dtype=np.int64)
+        self._h = extent / self._shape
+
+        # CSR map from bucket to the cells whose bounding box overlaps it
+        i0 = self._bucket_coords(cell_min)
+        i1 = self._bucket_coords(cell_max)
+        n_x = i1[:, 0] - i0[:, 0] + 1
+        counts = n_x * (i1[:, 1] - i0[:, 1] + 1)
+        cell_ids = np.repeat(np.arange(n_cells, dtype=np.int64), counts)
+        offsets = np.arange(counts.sum(), dtype=np.int64) \
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        ix = i0[cell_ids, 0] + offsets % n_x[cell_ids]
+        iy = i0[cell_ids, 1] + offsets // n_x[cell_ids]
+        buckets = ix * ny + iy
+
+        order = np.argsort(buckets, kind="stable")
+        self._bucket_cells = cell_ids[order]
+        self._bucket_ptr = np.searchsorted(buckets[order],
+                                           np.arange(nx * ny + 1, dtype=np.int64))
+
+    def _bucket_coords(self, x):
+        """Integer grid coordinates of the bucket containing each point"""
+        ij = np.floor((x - self._lo) / self._h).astype(np.int64)
+        return np.clip(ij, 0, self._shape - 1)
+
+    def _locate_chunk(self, x):
+        y_cells = np.full(x.shape[0], -1, dtype=np.int64)
+        if self.n_cells == 0:
+            return y_cells
+
+        ij = np.floor((x - self._lo) / self._h).astype(np.int64)
+        in_grid = np.all((ij >= 0) & (ij < self._shape), axis=1)
+        # Points on the upper bounding box edges
+        on_edge = np.all((ij >= 0) & (ij <= self._shape), axis=1) & ~in_grid
+        ij[on_edge] = np.minimum(ij[on_edge], self._shape - 1)
+        in_grid |= on_edge
+
+        points = np.flatnonzero(in_grid)
+        buckets = ij[points, 0] * self._shape[1] + ij[points, 1]
+        start = self._bucket_ptr[buckets]
+        n_cand = self._bucket_ptr[buckets + 1] - start
+
+        # All (point, candidate cell) pairs
+        pair_points = np.repeat(points, n_cand)
+        pair_offsets = np.arange(n_cand.sum(), dtype=np.int64) \
+            - np.repeat(np.cumsum(n_cand) - n_cand, n_cand)
+        pair_cells = self._bucket_cells[np.repeat(start, n_cand) + pair_offsets]
+
+        lam = np.einsum("kij,kj->ki", self._T_inv[pair_cells],
+                        x[pair_points] - self._v0[pair_cells])
+        inside = np.all(lam >= -self.tolerance, axis=1) \
+            & (lam.sum(axis=1) <= 1.0 + self.tolerance)
+
+        # First containing cell for each point (reversed, so earlier wins)
+        hit_points = pair_points[inside][::-1]
+        hit_cells = pair_cells[inside][::-1]
+        y_cells[hit_points] = hit_cells
+        return y_cells
+
+    def locate(self, x_coords):
+        """
+        Return the local (owned) cell containing each point (rows of
+        x_coords), or -1 for points outside the owned part of the mesh
+        """
+        x_coords = np.ascontiguousarray(x_coords, dtype=np.float64)
+        key = hashlib.sha1(x_coords.view(np.uint8)).hexdigest() \
+            + str(x_coords.shape)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key].copy()
+
+        y_cells = np.concatenate(
+            [self._locate_chunk(x_coords[i:i + self.chunk_size, :])
+             for i in range(0, x_coords.shape[0], self.chunk_size)]
+            + [np.zeros(0, dtype=np.int64)])
+
+        self._results[key] = y_cells
+        if len(self._results) > _CACHE_SIZE:
+            self._results.popitem(last=False)
+        return y_cells.copy()
+
+
+def point_locator(mesh):
+    """Return the (cached) PointLocator for mesh"""
+    key = mesh.id()
+    if key in _locators:
+        _locators.move_to_end(key)
+    else:
+        _locators[key] = PointLocator(mesh)
+        if len(_locators) > _CACHE_SIZE:
+            _locators.popitem(last=False)
+    return _locators[key]
+
+
+def locate_points(x_coords, mesh, comm):
+    """
+    Locate the points x_coords (identical on all processes) in mesh
+
+    Returns (y_cells, x_local, x_global), where y_cells are the local cells
+    containing each point (-1 if not in the local part of the mesh), x_local
+    indicates the points owned by this process (a point lying in the cells of
+    several processes is owned by the lowest rank), and x_global the points
+    lying anywhere in the mesh.
+    """
+    y_cells = point_locator(mesh).locate(x_coords)
+
+    rank, size = comm.rank, comm.size
+    owner_local = np.where(y_cells >= 0, rank, size).astype(np.int64)
+    owner = np.empty_like(owner_local)
+    comm.Allreduce(owner_local, owner, op=MPI.MIN)
+
+    x_global = owner < size
+    x_local = owner == rank
+    y_cells[~x_local] = -1
+
+    n_discarded = x_coords.shape[0] - np.count_nonzero(x_global)
+    if n_discarded > 0 and rank == 0:
+        discarded = np.flatnonzero(~x_global)
+        x_min = x_coords[discarded, :].min(axis=0)
+        x_max = x_coords[discarded, :].max(axis=0)
+        log.info(f"{n_discarded} of {x_coords.shape[0]} observation points "
+                 f"discarded (outside mesh), within bounding box "
+                 f"({', '.join(map(str, x_min))}) - "
+                 f"({', '.join(map(str, x_max))})")
+        log.debug(f"Discarded observation points: {discarded}")
+
+    return y_cells, x_local, x_global
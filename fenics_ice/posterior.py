@@ -0,0 +1,293 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with fenics_ice.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Low-rank approximation of the posterior covariance (Isaac et al. 2015, eq. 20)
+
+    Gamma_post = Gamma_prior - W D W^T,    D = diag(lam / (lam + 1))
+
+where (lam, W) are the leading eigenpairs of the prior preconditioned misfit
+Hessian, with W orthonormal in the prior inverse (B) inner product.
+"""
+
+from .backend import Function, function_get_values, function_set_values, \
+    is_function, space_comm
+from .eigenbasis import EigenBasis, StreamedEigenBasis
+from .eigendecomposition import eigendec_output_paths, read_ev_norms
+
+from collections import OrderedDict
+import hashlib
+import logging
+import numpy as np
+import pickle
+
+log = logging.getLogger("fenics_ice")
+
+
+def _vector(x):
+    return x.vector() if is_function(x) else x
+
+
+def _local_values(x):
+    return function_get_values(x) if is_function(x) else x.get_local()
+
+
+def read_eigenvalues(params, truncate_nan=False):
+    """
+    Read the eigenvalues written by run_eigendec
+
+    NaN eigenvalues (eigenpairs which did not converge) raise a RuntimeError,
+    or if truncate_nan the eigenvalues are truncated before the first NaN.
+    """
+    _, _, lam_file = eigendec_output_paths(params)
+    with open(lam_file, 'rb') as ff:
+        eigendata = pickle.load(ff)
+        lam = eigendata[0].real.astype(np.float64)
+
+    # Check if eigendecomposition successfully produced num_eig
+    # or if some are NaN
+    if np.any(np.isnan(lam)):
+        if not truncate_nan:
+            raise RuntimeError("NaN eigenvalue(s)")
+        lam = lam[:np.argwhere(np.isnan(lam))[0][0]]
+
+    return lam
+
+
+class LowRankPosteriorCovariance:
+    """
+    Action of the low-rank posterior covariance Gamma_prior - W D W^T
+
+    reg_op is the Prior (whose inv_action is Gamma_prior), lam the eigenvalues
+    and W an EigenBasis of the corresponding eigenvectors. Prior covariance
+    actions, the expensive part, are cached for up to cache_size distinct
+    right-hand-sides.
+    """
+
+    def __init__(self, reg_op, lam, W, cache_size=8):
+        assert len(lam) == len(W)
+        self.reg_op = reg_op
+        self.space = reg_op.space
+        self.comm = space_comm(self.space)
+        self.lam = np.asarray(lam, dtype=np.float64)
+        self.W = W
+        self.D = self.lam / (self.lam + 1.0)  # D_r Isaac 20
+
+        self._cache_size = cache_size
+        self._prior_cache = OrderedDict()
+
+    @classmethod
+    def from_eigendec(cls, params, reg_op, max_eig=None,
+                      eigenvalue_thresh=None, truncate_nan=False, **kwargs):
+        """
+        Load the eigenpairs written by run_eigendec (once)
+
+        Optionally keep only the first max_eig eigenpairs, and of those only
+        the ones with eigenvalues above eigenvalue_thresh. If
+        params.eigendec.ev_memory_budget is set the eigenvectors are streamed
+        from file (StreamedEigenBasis) rather than held in memory.
+        """
+        lam = read_eigenvalues(params, truncate_nan=truncate_nan)
+        if max_eig is not None and max_eig > 0:
+            lam = lam[:max_eig]
+
+        ev_filepath, _, _ = eigendec_output_paths(params)
+        validation = params.eigendec.ev_validation
+        norms = read_ev_norms(params) if validation == "table" else None
+        validation_kwargs = {"reg_op": reg_op,
+                             "eps": params.constants.float_eps,
+                             "validation": validation,
+                             "n_samples": params.eigendec.ev_validation_samples,
+                             "norms": norms}
+        memory_budget = params.eigendec.ev_memory_budget
+        if memory_budget is None:
+            W = EigenBasis.from_file(reg_op.space, ev_filepath, len(lam),
+                                     **validation_kwargs)
+        else:
+            W = StreamedEigenBasis.from_file(reg_op.space, ev_filepath,
+                                             len(lam), memory_budget,
+                                             **validation_kwargs)
+
+        if eigenvalue_thresh is not None:
+            # take only the largest eigenvalues
+            pind = np.flatnonzero(lam > eigenvalue_thresh)
+            lam = lam[pind]
+            W = W.subset(pind)
+
+        return cls(reg_op, lam, W, **kwargs)
+
+    def __len__(self):
+        return len(self.lam)
+
+    def apply_prior(self, x):
+        """Gamma_prior x, as a new function"""
+        return self.apply_prior_block([x])[0]
+
+    def apply_prior_block(self, X):
+        """
+        Gamma_prior x for each function or vector x in the list X, as new
+        functions, with prior solves only for the uncached x
+        """
+        keys = self._cache_keys(X)
+
+        new = [j for j, key in enumerate(keys)
+               if key not in self._prior_cache and key not in keys[:j]]
+        Y_new = [Function(self.space) for j in new]
+        self.reg_op.inv_action_block([_vector(X[j]) for j in new],
+                                     [y.vector() for y in Y_new])
+        new_vals = {keys[j]: function_get_values(y)
+                    for j, y in zip(new, Y_new)}
+
+        Y = []
+        for key in keys:
+            if key in new_vals:
+                y_vals = new_vals[key]
+            else:
+                y_vals = self._prior_cache[key]
+                self._prior_cache.move_to_end(key)
+            y = Function(self.space)
+            function_set_values(y, y_vals)
+            Y.append(y)
+
+        for key, y_vals in new_vals.items():
+            self._prior_cache[key] = y_vals
+            if len(self._prior_cache) > self._cache_size:
+                self._prior_cache.popitem(last=False)
+
+        return Y
+
+    def _cache_keys(self, X):
+        """
+        Prior cache keys for the functions or vectors in the list X
+
+        The keys hash the digests of the local values on every process, so
+        that all processes agree on which x are cached (the prior solves are
+        collective).
+        """
+        local_keys = [hashlib.sha1(np.ascontiguousarray(_local_values(x))
+                                   .view(np.uint8)).digest() for x in X]
+        all_keys = self.comm.allgather(local_keys)
+        return [hashlib.sha1(b"".join(rank_keys[j] for rank_keys in all_keys))
+                .hexdigest() for j in range(len(X))]
+
+    def reduction(self, x, n=None):
+        """
+        W D W^T x (using the first n eigenpairs, by default all), as a new
+        function
+        """
+        n = len(self) if n is None else n
+        W = self.W if n == len(self) else self.W.subset(slice(0, n))
+        _, Y = W.weighted_projection_block(_local_values(x)[np.newaxis, :],
+                                           self.D[:n])
+        y = Function(self.space)
+        function_set_values(y, Y[0, :])
+        return y
+
+    def apply(self, x):
+        """(Gamma_prior - W D W^T) x, as a new function"""
+        y = self.apply_prior(x)
+        y.vector().axpy(-1.0, self.reduction(x).vector())
+        return y
+
+    def apply_block(self, X):
+        """
+        (Gamma_prior - W D W^T) x for each function or vector x in the list X,
+        with the low-rank part computed for the whole block at once
+        """
+        if len(X) == 0:
+            return []
+        _, WDWtX = self.W.weighted_projection_block(
+            np.stack([_local_values(x) for x in X]), self.D)
+        Y = self.apply_prior_block(X)
+        for y, wdwtx in zip(Y, WDWtX):
+            function_set_values(y, function_get_values(y) - wdwtx)
+        return Y
+
+    def variance(self, x):
+        """
+        (x^T Gamma_post x, x^T Gamma_prior x), the posterior & prior variances
+        of the linear functional x
+        """
+        y = self.apply_prior(x)
+        var_prior = _vector(y).inner(_vector(x))
+        WtX = self.W.inner(x)
+        var_post = var_prior - np.dot(self.D * WtX, WtX)
+        return var_post, var_prior
+
+    def variance_block(self, X, return_inner=False):
+        """
+        Posterior & prior variances, as arrays, of the linear functionals in
+        the list X, with a single W^T X product and one block of prior solves
+
+        If return_inner, W^T X is returned as well.
+        """
+        if len(X) == 0:
+            WtX = np.zeros((len(self), 0))
+            var_prior = np.zeros(0)
+        else:
+            WtX = self.W.inner_block(np.stack([_local_values(x) for x in X]))
+            Y = self.apply_prior_block(X)
+            var_prior = np.array([_vector(y).inner(_vector(x))
+                                  for x, y in zip(X, Y)])
+        var_post = var_prior - np.dot(self.D, WtX ** 2)
+        if return_inner:
+            return var_post, var_prior, WtX
+        return var_post, var_prior
+
+    def sample(self, x):
+        """
+        Transform standard normal noise x (a vector or function) into samples
+        (z, a) from the prior & (Gaussian approximated) posterior, as
+            z = Gamma_prior^{1/2} x
+            a = z + W (diag(1 / sqrt(lam + 1)) - I) W^T Gamma_prior^{-1/2} x
+        """
+        z = Function(self.space)
+        self.reg_op.sqrt_inv_action(_vector(x), z.vector())  # Gamma 1/2 N
+
+        y = Function(self.space)
+        self.reg_op.sqrt_action(_vector(x), y.vector())  # Gamma -1/2 N
+
+        a = self.W.combine((1.0 / np.sqrt(self.lam + 1.0) - 1.0) * self.W.inner(y))
+        a.vector().axpy(1.0, z.vector())
+        return z, a
+
+    def apply_sqrt(self, x):
+        """Gamma_post^{1/2} x, as a new function"""
+        _, a = self.sample(x)
+        return a
+
+    def diagonal_estimate(self, n_samples, rng=None):
+        """
+        Monte Carlo estimate of the pointwise prior & posterior variances
+        (the diagonals of Gamma_prior & Gamma_post), as functions
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        x = Function(self.space)
+        shp = function_get_values(x).shape
+        var_prior = np.zeros(shp, dtype=np.float64)
+        var_post = np.zeros(shp, dtype=np.float64)
+
+        for i in range(n_samples):
+            function_set_values(x, rng.standard_normal(shp))
+            z, a = self.sample(x)
+            var_prior += function_get_values(z) ** 2 / n_samples
+            var_post += function_get_values(a) ** 2 / n_samples
+
+        diag_prior, diag_post = Function(self.space), Function(self.space)
+        function_set_values(diag_prior, var_prior)
+        function_set_values(diag_post, var_post)
+        return diag_prior, diag_post
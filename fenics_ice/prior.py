@@ -15,15 +15,18 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with fenics_ice.  If not, see <https://www.gnu.org/licenses/>.
 
-from .backend import Constant, Function, KrylovSolver, TestFunctions, \
-    TrialFunctions, Vector, assemble, dx, grad, inner, solve
+from .backend import Constant, EquationSolver, Function, KrylovSolver, \
+    LUSolver, TestFunctions, TrialFunctions, Vector, assemble, dx, grad, \
+    has_krylov_solver_preconditioner, inner
+from tlm_adjoint.fenics.backend import backend_assemble
 
 from .decorators import count_calls, timer
-from .eigendecomposition import flag_errors
-from fenics_ice.sqrt_matrix_action import A_root_action, LumpedPCSqrtMassAction
+from .eigendecomposition import dolfin_vector, flag_errors
+from fenics_ice.sqrt_matrix_action import LumpedPCSqrtMassAction
 
 
 from abc import ABC, abstractmethod
+import numpy as np
 import ufl
 
 class Prior(ABC):
@@ -44,6 +47,17 @@ class Prior(ABC):
         """The inverse action of the prior on a vector"""
         pass
 
+    def inv_action_block(self, X, Y):
+        """
+        The inverse action of the prior on each vector of the list X, into
+        the corresponding vector of Y
+
+        This applies inv_action to each vector in turn.
+        """
+        assert len(X) == len(Y)
+        for x, y in zip(X, Y):
+            self.inv_action(x, y)
+
     def __init__(self, slvr, space):
         """Create object members & construct the mass & prior operators"""
         self.solver = slvr
@@ -66,6 +80,17 @@ class Prior(ABC):
         self.alpha_active = slvr.params.inversion.alpha_active
         self.beta_active = slvr.params.inversion.beta_active
 
+        # Lumped mass matrix? This is exact row-sum lumping via vertex
+        # quadrature, which requires P1
+        self.lumped_mass = slvr.params.inversion.lumped_mass_prior
+        if self.lumped_mass:
+            if space.ufl_element().degree() != 1:
+                raise NotImplementedError("Lumped mass prior requires a P1 space")
+            self.dx_m = dx(metadata={"quadrature_rule": "vertex",
+                                     "quadrature_degree": 1})
+        else:
+            self.dx_m = dx
+
         self.test = TestFunctions(space)
         self.trial = TrialFunctions(space)
 
@@ -86,8 +111,11 @@ class Prior(ABC):
         self.A.init_vector(self.tmp1, 0)
         self.A.init_vector(self.tmp2, 1)
 
-        # preconditioned solver object to find square root of mass matrix (not used)
-        self.lumpedPCMassSolver = LumpedPCSqrtMassAction(space=self.space, tol=1.0e-16, beta=2.0/3.0)
+        # preconditioned solver object to find square root of mass matrix
+        # (trivial for the lumped mass matrix)
+        if not self.lumped_mass:
+            self.lumpedPCMassSolver = LumpedPCSqrtMassAction(
+                space=self.space, tol=1.0e-16, beta=2.0/3.0)
 
     def placeholder_fn(self, name, idx):
         """
@@ -106,14 +134,83 @@ class Prior(ABC):
         return tmp
 
     def construct_mass_operator(self):
-        """Construct the mass operator self.M and its solver self.M_solver"""
-        self.M = assemble(sum(self.var_m) * dx)
+        """
+        Construct the mass operator self.M and its solvers self.M_solver
+        (iterative) & self.M_lu_solver (direct, used by J_reg)
+
+        For the lumped mass matrix, M^-1 and M^1/2 are diagonal scalings by
+        self.M_L_inv and self.sqrt_M_L.
+        """
+        self.M = assemble(sum(self.var_m) * self.dx_m)
+
+        if self.lumped_mass:
+            M_L = assemble(sum(self.test, ufl.zero()) * dx)
+            self.M_L_inv = M_L.copy()
+            self.M_L_inv.set_local(1.0 / M_L.get_local())
+            self.M_L_inv.apply("insert")
+            self.sqrt_M_L = M_L.copy()
+            self.sqrt_M_L.set_local(np.sqrt(M_L.get_local()))
+            self.sqrt_M_L.apply("insert")
+            return
 
         self.M_solver = KrylovSolver("cg", "sor")
         self.M_solver.parameters.update({"absolute_tolerance": 1.0e-32,
                                          "relative_tolerance": 1.0e-14})
         self.M_solver.set_operator(self.M)
 
+        # Factorised on the first solve, and reused thereafter
+        self.M_lu_solver = LUSolver(self.M, "default")
+
+    def construct_prior_solver(self, A):
+        """
+        Construct the solver for the prior operator, as selected by
+        params.inversion.prior_solver:
+
+        'cg'  : CG with SOR preconditioning
+        'amg' : CG with algebraic multigrid preconditioning
+        'lu'  : sparse direct solver. A is factorised on the first solve and
+                the factors are reused for every subsequent solve.
+        """
+        method = self.solver.params.inversion.prior_solver
+
+        if method == "lu":
+            return LUSolver(A, "default")
+
+        if method == "amg":
+            pc = "hypre_amg" if has_krylov_solver_preconditioner("hypre_amg") \
+                else "petsc_amg"
+        else:
+            pc = "sor"
+
+        A_solver = KrylovSolver("cg", pc)
+        A_solver.parameters.update({"absolute_tolerance": 1.0e-32,
+                                    "relative_tolerance": 1.0e-14})
+        A_solver.set_operator(A)
+        return A_solver
+
+    def mass_inv_action(self, x, y):
+        """y = M^-1 x"""
+        if self.lumped_mass:
+            y.set_local(self.M_L_inv.get_local() * x.get_local())
+            y.apply("insert")
+        else:
+            self.M_solver.solve(y, x)
+
+    def mass_inv_action_lu(self, x, y):
+        """y = M^-1 x, using the factorised mass matrix"""
+        if self.lumped_mass:
+            self.mass_inv_action(x, y)
+        else:
+            self.M_lu_solver.solve(y, x)
+
+    def sqrt_mass_action(self, x):
+        """Return M^1/2 x (in the sense A A^T = M)"""
+        if self.lumped_mass:
+            return self.sqrt_M_L * x
+        else:
+            y, terms = self.lumpedPCMassSolver.action(x)
+            return y
+
     def construct_prior_operator(self):
         """
         Construct the prior operator (self.A) and its solver (self.A_solver)
@@ -139,10 +236,7 @@ class Prior(ABC):
                 self.A_form = beta_form
 
         self.A = assemble(self.A_form)
-        self.A_solver = KrylovSolver("cg", "sor")
-        self.A_solver.parameters.update({"absolute_tolerance": 1.0e-32,
-                                         "relative_tolerance": 1.0e-14})
-        self.A_solver.set_operator(self.A)
+        self.A_solver = self.construct_prior_solver(self.A)
 
         self.tmp1, self.tmp2 = Vector(), Vector()
         self.A.init_vector(self.tmp1, 0)
@@ -152,7 +246,9 @@ class Prior(ABC):
         """
         Compute the regularisation term of the cost function
 
-        Returns a list of 1 or 2 terms depending on inversion type.
+        Returns a list of 1 or 2 terms depending on inversion type. Each term
+        is 0.5 * || M^-1 b ||^2_M = 0.5 * b^T M^-1 b, for b the assembled
+        (linear) prior form.
         """
         # Check we received the args we expected based on prior_form
         assert list(kwargs.keys()) == list(self.LUT.values()), \
@@ -171,32 +267,28 @@ class Prior(ABC):
         # no need to mess with alpha_idx, beta_idx
         trial = self.trial[0]
         test = self.test[0]
+        a = inner(test, trial) * self.dx_m
 
         if self.alpha_active:
 
             f_alpha = Function(space, name='f_alpha')
             L = ufl.replace(self.alpha_form, placeholder_map)
 
-            a = test * trial * dx
-
             # alpha form is negative laplacian
-            solve(a == L, f_alpha,  # M^{-1} L alpha
-                  solver_parameters={"linear_solver": "direct"})
+            MassSolver(self, a == L, f_alpha,  # M^{-1} L alpha
+                       solver_parameters={"linear_solver": "direct"}).solve()
 
-            J_reg_alpha = self.norm_sq(f_alpha)  # L M^{-1} M M^{-1} L alpha
-                                                 # = L M^{-1} L alpha
-            result[0] = J_reg_alpha
+            # L M^{-1} M M^{-1} L alpha = L M^{-1} L alpha
+            result[0] = 0.5 * inner(f_alpha, f_alpha) * self.dx_m
 
         if self.beta_active:
 
             f_beta = Function(space, name='f_beta')
-
             L = ufl.replace(self.beta_form, placeholder_map)
-            a = test * trial * dx
 
-            solve(a == L, f_beta, solver_parameters={"linear_solver": "direct"})
-            J_reg_beta = self.norm_sq(f_beta)
-            result[1] = J_reg_beta
+            MassSolver(self, a == L, f_beta,
+                       solver_parameters={"linear_solver": "direct"}).solve()
+            result[1] = 0.5 * inner(f_beta, f_beta) * self.dx_m
 
         return result
 
@@ -205,7 +297,8 @@ class Prior(ABC):
         Compute the seperate terms of the regularisation term (J_reg)
 
         Returns a dict of named computed terms (e.g. 'delta_beta',
-        'gamma_beta')
+        'gamma_beta'). These are diagnostics only, so are computed without
+        annotation.
         """
         # Check we received the args we expected based on prior_form
         assert list(kwargs.keys()) == list(self.LUT.values()), \
@@ -217,29 +310,54 @@ class Prior(ABC):
         for k in self.LUT:
             placeholder_map[k] = kwargs[self.LUT[k]]
 
-        space = self.space
-        # result = [None, None]
         result = {}
 
         # Note - because this is never used in mixed space mode,
         # no need to mess with alpha_idx, beta_idx
-        trial = self.trial[0]
-        test = self.test[0]
-
+        y = self.tmp1.copy()
         for term_key in self.terms:
             term = self.terms[term_key]
-            f = Function(space, name=term_key)
             L = ufl.replace(term, placeholder_map)
-            a = test * trial * dx
-
-            solve(a == L, f,  # M^{-1} L alpha
-                  solver_parameters={"linear_solver": "direct"})
 
-            result[term_key] = self.norm_sq(f)   # L M^{-1} M M^{-1} L alpha
-        #                                          # = L M^{-1} L alpha
+            b = backend_assemble(L)
+            self.mass_inv_action_lu(b, y)  # M^{-1} L alpha
+            result[term_key] = 0.5 * y.inner(b)  # L M^{-1} M M^{-1} L alpha
+            #                                    # = L M^{-1} L alpha
 
         return result
 
+
+class MassSolver(EquationSolver):
+    """
+    EquationSolver for the mass matrix problem a == L of a Prior, with a the
+    mass form of the Prior
+
+    The forward solve uses the factorised mass matrix kept on the Prior (see
+    Prior.mass_inv_action_lu), so that M is factorised once rather than on
+    every evaluation of J_reg. Recomputations with supplied dependencies,
+    and the tangent-linear & adjoint, use the default EquationSolver solves.
+    """
+    def __init__(self, prior, *args, **kwargs):
+        super(MassSolver, self).__init__(*args, **kwargs)
+        self._mass_inv_action = prior.mass_inv_action_lu
+
+    def drop_references(self):
+        super().drop_references()
+        self._mass_inv_action = None
+
+    def forward_solve(self, x, deps=None):
+        if deps is not None or x is not self.x() \
+                or self._mass_inv_action is None:
+            super().forward_solve(x, deps=deps)
+            return
+
+        fcp = self._form_compiler_parameters
+        if fcp is None:
+            fcp = {}
+        b = backend_assemble(self._rhs, form_compiler_parameters=fcp)
+        self._mass_inv_action(b, x.vector())
+
+
 class Laplacian(Prior):
     """
     Laplacian prior implementation
@@ -279,13 +397,10 @@ class Laplacian(Prior):
 
             self.beta_form = self.terms['delta_beta'] + self.terms['gamma_beta']
 
-        # The square norm of the prior for J_reg
-        self.norm_sq = lambda x: 0.5 * inner(x, x) * dx
-
     def action(self, x, y):
         """LM^-1L"""
         self.A.mult(x, self.tmp1)  # tmp1 = Ax
-        self.M_solver.solve(self.tmp2, self.tmp1)  # Atmp2 = tmp1
+        self.mass_inv_action(self.tmp1, self.tmp2)  # Mtmp2 = tmp1
         self.A.mult(self.tmp2, self.tmp1)
         y.set_local(self.tmp1.get_local())
         y.apply("insert")
@@ -294,21 +409,18 @@ class Laplacian(Prior):
         """L^-1 M L^-1"""
         self.A_solver.solve(self.tmp1, x)
         self.M.mult(self.tmp1, self.tmp2)
-        self.A_solver.solve(self.tmp1, self.tmp2)
-
-        y.set_local(self.tmp1.get_local())
-        y.apply("insert")
+        self.A_solver.solve(y, self.tmp2)
 
     def sqrt_action(self,x,y):  # sqrt of inv cov: Gamma -1 Gamma 1/2
                                 #                  L M-1 L L-1 M1/2
                                 #                  L M-1 M1/2
-        self.tmp1, terms = self.lumpedPCMassSolver.action(x)
-        self.M_solver.solve(self.tmp2, self.tmp1) 
+        self.tmp1 = self.sqrt_mass_action(x)
+        self.mass_inv_action(self.tmp1, self.tmp2)
         self.A.mult(self.tmp2,y)
 
     def sqrt_inv_action(self,x,y):  # sqrt of inv cov: Gamma 1/2
                                     #                  L-1 M1/2
-        self.tmp1, terms = self.lumpedPCMassSolver.action(x)
+        self.tmp1 = self.sqrt_mass_action(x)
         self.A_solver.solve(y, self.tmp1)
 
 class Laplacian_flt(Laplacian):
@@ -365,9 +477,6 @@ class Laplacian_flt(Laplacian):
                               self.terms['gamma_beta'] +
                               self.terms['delta_beta_gnd'])
 
-        # The square norm of the prior for J_reg
-        self.norm_sq = lambda x: 0.5 * inner(x, x) * dx
-
 
 class LaplacianPC:
     """
@@ -379,8 +488,6 @@ class LaplacianPC:
     def __init__(self, lap):
         self.laplacian = lap
         self.action = self.laplacian.inv_action
-        self.x_tmp = Function(self.laplacian.space).vector()
-        self.y_tmp = Function(self.laplacian.space).vector()
 
     @flag_errors
     def setUp(self, pc):
@@ -389,12 +496,5 @@ class LaplacianPC:
     @count_calls(1, 'LaplacianPC')
     @flag_errors
     def apply(self, pc, x, y):
-
-        self.x_tmp.set_local(x.array)
-        self.x_tmp.apply("insert")
-
-        self.action(self.x_tmp, self.y_tmp)
-
-        y.array = self.y_tmp.get_local()
-        # TODO - do we need a y.assemble() here?
-        # or y.assemblyBegin(), assemblyEnd()?
+        # Operate on x & y in place, via DOLFIN wrappers of the PETSc Vecs
+        self.action(dolfin_vector(x), dolfin_vector(y))
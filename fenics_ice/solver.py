@@ -16,12 +16,18 @@
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
 from .backend import *
+from tlm_adjoint.fenics.backend import backend_assemble
+from fenics import Constant as backend_Constant
+from fenics import NonlinearVariationalProblem as backend_NonlinearVariationalProblem
+from fenics import NonlinearVariationalSolver as backend_NonlinearVariationalSolver
 
 from . import inout
 from .minimize_l_bfgs import minimize_l_bfgs
 from .minimize_l_bfgs import \
     line_search_rank0_scipy_scalar_search_wolfe1 as line_search_rank0
+from .point_location import locate_points
 
+import hashlib
 import logging
 import mpi4py.MPI as MPI  # noqa: N817
 import numpy as np
@@ -34,40 +40,17 @@ log = logging.getLogger("fenics_ice")
 
 
 def interior(x_coords, y_space):
-    bbox = y_space.mesh().bounding_box_tree()
-    y_cells = y_space.mesh().num_cells()
-
-    interior_local = np.full(x_coords.shape[0], -1, dtype=np.uint8)
-    for i in range(x_coords.shape[0]):
-        point = Point(*x_coords[i, :])
-        cell = bbox.compute_first_entity_collision(point)
-        if cell < y_cells:
-            interior_local[i] = 1
-        else:
-            interior_local[i] = 0
-
-    interior_global = np.full(x_coords.shape[0], -1, dtype=np.uint8)
-    space_comm(y_space).Allreduce(interior_local, interior_global,
-                                  op=MPI.MAX)
-
-    assert (interior_global >= 0).all() and (interior_global <= 1).all()
-    return np.array(interior_global == 1, dtype=bool)
+    _, _, x_global = locate_points(x_coords, y_space.mesh(),
+                                   space_comm(y_space))
+    return x_global
 
 
 def interpolation_matrix(x_coords, y_space):
     from tlm_adjoint.fenics.fenics_equations import greedy_coloring, \
-        interpolation_matrix, point_owners
+        interpolation_matrix
 
-    y_cells = point_owners(x_coords, y_space, tolerance=np.inf)
-    x_local = np.array(y_cells >= 0, dtype=bool)
-
-    x_global = interior(x_coords, y_space)
-    for i in range(x_coords.shape[0]):
-        if x_local[i] and not x_global[i]:
-            log.info("Observation point %i discarded, coordinate (%s)"
-                     % (i, ", ".join(map(lambda c: f"{c}",
-                                         x_coords[i, :]))))
-            x_local[i] = False
+    y_cells, x_local, _ = locate_points(x_coords, y_space.mesh(),
+                                        space_comm(y_space))
 
     y_colors = greedy_coloring(y_space)
     P = interpolation_matrix(x_coords[x_local, :], space_new(y_space),
@@ -182,10 +165,22 @@ class ssa_solver:
         self.ds = Measure('ds', domain=self.mesh, subdomain_data=self.ff)
 
         self.dt = Constant(self.params.time.dt, name="dt")
+        self._dt_constants = {}
+
+        # Persistent MomentumSolver (see MomsolveCfg.reuse_solver)
+        self._momsolver = None
+        self._mom_eq_controls = None
+        self.mom_iterations = None
+        # Persistent ThicknessSolvers (see MassSolveCfg.reuse_solver)
+        self._thicksolvers = {}
 
         self.eigenvals = None
         self.eigenfuncs = None
 
+        # Prior used in comp_J_inv, see get_prior
+        self._prior = None
+        self._prior_key = None
+
     def set_inv_params(self):
         """Set delta_alpha, gamma_alpha, etc from config"""
         invparam = self.params.inversion
@@ -205,6 +200,23 @@ class ssa_solver:
         if self.delta_beta_gnd is not None:
             self.delta_beta_gnd = 1E-10
 
+    def inv_params(self):
+        """The current (delta_alpha, gamma_alpha, ...) as a tuple"""
+        return (self.delta_alpha, self.gamma_alpha, self.delta_beta,
+                self.delta_beta_gnd, self.gamma_beta)
+
+    def get_prior(self):
+        """
+        Return the prior on self.Qp, constructed only when the regularisation
+        parameters change (e.g. through zero_inv_params/set_inv_params)
+        """
+        Prior = self.model.get_prior()
+        key = (Prior, self.inv_params())
+        if self._prior is None or key != self._prior_key:
+            self._prior = Prior(self, self.Qp)
+            self._prior_key = key
+        return self._prior
+
     def get_mixed_space(self):
         """Return the mixed function space for alphaXbeta"""
         el = FiniteElement("Lagrange", self.mesh.ufl_cell(), 1)
@@ -360,6 +372,9 @@ class ssa_solver:
     def def_mom_eq(self):
         """Define the momentum equation to be solved in solve_mom_eq"""
 
+        # Record the control functions the equation is defined in terms of
+        self._mom_eq_controls = (self._alpha, self._beta, self._alphaXbeta)
+
         # Simplify accessing fields and parameters
         constants = self.params.constants
         bed = self.bed
@@ -543,28 +558,76 @@ class ssa_solver:
 
         return B2
 
-    def solve_mom_eq(self, annotate_flag=None):
-        """Solve the momentum equation defined in def_mom_eq"""
-
-        t0 = time.perf_counter()
+    def solve_mom_eq(self, annotate_flag=None, warm=False):
+        """
+        Solve the momentum equation defined in def_mom_eq
 
-        newton_params = self.params.momsolve.newton_params
-        picard_params = self.params.momsolve.picard_params
-        quad_degree = self.params.momsolve.quadrature_degree
-        J_p = self.mom_Jac_p
+        warm indicates that self.U holds a good initial guess (see
+        MomsolveCfg.adaptive_picard)
+        """
 
-        momsolver = MomentumSolver(self.mom_F == 0,
-                                   self.U,
-                                   bcs=self.flow_bcs,
-                                   J_p=J_p,
-                                   picard_params=picard_params,
-                                   solver_parameters=newton_params,
-                                   form_compiler_parameters=None if quad_degree == -1 else {"quadrature_degree": quad_degree})
+        t0 = time.perf_counter()
 
+        momsolver = self.get_momsolver()
+        momsolver.warm_start = warm
         momsolver.solve(annotate=annotate_flag)
+        self.mom_iterations = momsolver.iterations
 
         t1 = time.perf_counter()
         info("Time for solve: {0}".format(t1-t0))
+        its = ", ".join(f"{key} {value}"
+                        for key, value in self.mom_iterations.items()
+                        if value is not None)
+        info(f"Momentum solve iterations: {its}")
+
+    def get_momsolver(self):
+        """
+        Return a MomentumSolver for the momentum equation defined in def_mom_eq
+
+        If params.momsolve.reuse_solver, the MomentumSolver (and the assembly &
+        linear solver data it holds) is cached, and only rebuilt when the
+        momentum equation is redefined.
+        """
+        momconfig = self.params.momsolve
+        reuse = momconfig.reuse_solver
+
+        if reuse and self._momsolver is not None \
+           and self._momsolver[0] is self.mom_F:
+            return self._momsolver[1]
+
+        quad_degree = momconfig.quadrature_degree
+        if momconfig.adaptive_picard:
+            picard_switch_rtol = momconfig.picard_switch_rtol
+            newton_retries = momconfig.newton_retries
+        else:
+            picard_switch_rtol = None
+            newton_retries = 0
+        momsolver = MomentumSolver(self.mom_F == 0,
+                                   self.U,
+                                   bcs=self.flow_bcs,
+                                   J_p=self.mom_Jac_p,
+                                   picard_params=momconfig.picard_params,
+                                   solver_parameters=momconfig.newton_params,
+                                   form_compiler_parameters=None if quad_degree == -1 else {"quadrature_degree": quad_degree},
+                                   reuse=reuse,
+                                   picard_switch_rtol=picard_switch_rtol,
+                                   newton_retries=newton_retries,
+                                   forcing=momconfig.forcing_params(),
+                                   pc_rebuild_factor=momconfig.pc_rebuild_factor
+                                   if momconfig.reuse_preconditioner else None)
+
+        if reuse:
+            self._momsolver = (self.mom_F, momsolver)
+        return momsolver
+
+    def mom_eq_current(self):
+        """
+        Is the momentum equation (as last defined by def_mom_eq) defined in
+        terms of the current control functions?
+        """
+        return self._mom_eq_controls is not None and \
+            all(a is b for a, b in zip(self._mom_eq_controls,
+                                       (self._alpha, self._beta, self._alphaXbeta)))
 
     def def_thickadv_eq(self):
         """
@@ -663,13 +726,238 @@ class ssa_solver:
 
         self.H_bcs = []
 
-    def solve_thickadv_eq(self):
-        """Solve the thickness equation defined in def_thickadv_eq"""
+        # Thickness equations & solvers for other time step lengths
+        self._thickadv_dt = {}
+        self._thicksolvers = {}
+
+        if self.params.mass_solve.explicit_thickness or self.params.time.adaptive_dt:
+            self.def_thickadv_cfl()
+        if self.params.mass_solve.explicit_thickness:
+            self.def_thickadv_explicit_eq()
+
+    def def_thickadv_cfl(self):
+        """
+        Define the form thickadv_outflow, which when divided by cell area gives
+        the upwind outflow rate of each DG0 cell (the CFL number per unit time)
+        """
+        U_np = self.U_np
+        nm = self.nm
+        Ksi = TestFunction(self.M)
+
+        U_n = dot(U_np, nm)
+        U_n_out = 0.5 * (U_n + abs(U_n))
+
+        self.thickadv_outflow = ((Ksi * U_n_out)('+') * self.dS
+                                 + (Ksi * U_n_out)('-') * self.dS
+                                 + Ksi * U_n_out * self.ds)
+        self.thickadv_area = backend_assemble(Ksi * dx)
+
+    def def_thickadv_explicit_eq(self):
+        """
+        Define the explicit (forward Euler, upwind finite volume) form of the
+        DG0 thickness equation, for a substep dt_sub:
+
+        (H, Ksi) = (H_sub, Ksi) - dt_sub * thickadv_flux(H_sub)
+        """
+        U_np = self.U_np
+        Ksi = self.Ksi
+        nm = self.nm
+        ds = self.ds
+        dS = self.dS
+
+        self.H_sub = Function(self.H.function_space(), name="H_sub")
+        H_sub = self.H_sub
+        U_n = dot(U_np, nm)
+        U_n_out = 0.5 * (U_n + abs(U_n))
+
+        self.thickadv_flux = (
+            # Advection
+            - inner(grad(Ksi), U_np * H_sub) * dx
+
+            # Upwind flux
+            + inner(jump(Ksi), jump(U_n_out * H_sub)) * dS
+
+            # basal melting
+            + self.bmelt * Ksi * dx
+
+            # surface mass balance
+            - self.smb * Ksi * dx
+
+            # Outflow at boundaries
+            + conditional(U_n > 0, 1.0, 0.0) * inner(Ksi, U_n * H_sub) * ds
+
+            # Inflow at boundaries
+            + conditional(U_n < 0, 1.0, 0.0) * inner(Ksi, U_n * self.H_init) * ds
+        )
+
+        # Explicit update equations, per substep length
+        self._thickadv_explicit = {}
+
+    def dt_constant(self, dt):
+        """
+        Return a Constant with value dt
+
+        Constants are cached by value and never modified, as required for
+        their use in annotated equations.
+        """
+        dt = float(dt)
+        if float(self.dt) == dt:
+            return self.dt
+        if dt not in self._dt_constants:
+            self._dt_constants[dt] = Constant(dt, name="dt")
+        return self._dt_constants[dt]
+
+    def thickadv_cfl_rate(self):
+        """Maximum outflow rate over cells, i.e. the CFL number per unit time"""
+        outflow = backend_assemble(self.thickadv_outflow)
+        rate = outflow.get_local() / self.thickadv_area.get_local()
+        rate_max = rate.max() if rate.size > 0 else 0.0
+        return self.mesh.mpi_comm().allreduce(rate_max, op=MPI.MAX)
+
+    def cfl_dt(self):
+        """
+        Time step length for adaptive time stepping, from the CFL condition
+        for the current U_np
+
+        The step is params.time.dt times a power of two (limiting the number
+        of distinct equations), bounded by params.time.dt_min & dt_max.
+        """
+        config = self.params.time
+        rate = self.thickadv_cfl_rate()
+        if rate > 0.0:
+            dt = config.dt * 2.0 ** np.floor(np.log2(config.cfl / (rate * config.dt)))
+        else:
+            dt = config.dt_max
+        if dt < config.dt_min:
+            log.warning(f"CFL time step {dt} limited by dt_min {config.dt_min}")
+        return min(max(dt, config.dt_min), config.dt_max)
+
+    def timestep_times(self, t_events):
+        """
+        Generate the (time at the end, length) of each time step
+
+        For fixed time stepping, these are the params.time.total_steps steps
+        of length dt. For adaptive time stepping, step lengths are chosen by
+        cfl_dt (for U_np at the start of each step), but truncated (or the
+        remaining interval halved, to avoid very short steps) so as to land
+        exactly on each of the sorted t_events.
+        """
+        config = self.params.time
+        if not config.adaptive_dt:
+            for n in range(config.total_steps):
+                yield (n + 1) * config.dt, config.dt
+            return
+
+        t = 0.0
+        for t_event in t_events:
+            while t < t_event:
+                dt = self.cfl_dt()
+                if t + dt > t_event - config.dt_min:
+                    dt = t_event - t if t_event - t <= dt else 0.5 * (t_event - t)
+                t = t_event if dt == t_event - t else t + dt
+                yield t, dt
+
+    def solve_thickadv_explicit_eq(self, dt=None):
+        """
+        Solve the thickness equation over one time step (of length dt, by
+        default self.dt) with the explicit scheme defined in
+        def_thickadv_explicit_eq, substepping as needed to satisfy the CFL
+        condition.
+        """
+        dt = float(self.dt if dt is None else dt)
+        cfl = self.params.mass_solve.explicit_cfl
+        n_sub = max(1, int(np.ceil(dt * self.thickadv_cfl_rate() / cfl)))
+        if n_sub > 1:
+            info(f"Explicit thickness update: {n_sub} substeps")
+
+        dt_sub = self.dt_constant(dt / n_sub)
+        if float(dt_sub) not in self._thickadv_explicit:
+            H_trial = TrialFunction(self.H.function_space())
+            Ksi = self.Ksi
+            self._thickadv_explicit[float(dt_sub)] = EquationSolver(
+                inner(Ksi, H_trial) * dx
+                == inner(Ksi, self.H_sub) * dx - dt_sub * self.thickadv_flux,
+                self.H,
+                solver_parameters={"linear_solver": "cg",
+                                   "preconditioner": "jacobi",
+                                   "krylov_solver": {"relative_tolerance": 1.0e-14,
+                                                     "absolute_tolerance": 1.0e-32}},
+                cache_jacobian=True)
+        thick_eq = self._thickadv_explicit[float(dt_sub)]
+
+        self.H_sub.assign(self.H_np)
+        for i in range(n_sub):
+            if i > 0:
+                self.H_sub.assign(self.H)
+            thick_eq.solve()
+
+    def get_thickadv(self, dt=None):
+        """
+        Return the thickness equation defined in def_thickadv_eq, for time step
+        dt (by default self.dt)
+        """
+        dt = self.dt_constant(self.dt if dt is None else dt)
+        if dt is self.dt:
+            return self.thickadv
+        if float(dt) not in self._thickadv_dt:
+            self._thickadv_dt[float(dt)] = ufl.replace(self.thickadv, {self.dt: dt})
+        return self._thickadv_dt[float(dt)]
+
+    def solve_thickadv_eq(self, dt=None):
+        """
+        Solve the thickness equation defined in def_thickadv_eq, over a time
+        step dt (by default self.dt)
+        """
         H = self.H
-        a, L = lhs(self.thickadv), rhs(self.thickadv)
-        solve(a == L, H, bcs=self.H_bcs,
-              solver_parameters={"linear_solver": "lu"})
-        LocalProjection(self.H_DG, H).solve() 
+        mass_config = self.params.mass_solve
+        if mass_config.explicit_thickness:
+            self.solve_thickadv_explicit_eq(dt)
+            LocalProjection(self.H_DG, H).solve()
+        elif mass_config.reuse_solver:
+            thicksolver, H_DG_proj = self.get_thicksolver(dt)
+            thicksolver.solve()
+            H_DG_proj.solve()
+        else:
+            thickadv = self.get_thickadv(dt)
+            a, L = lhs(thickadv), rhs(thickadv)
+            solve(a == L, H, bcs=self.H_bcs,
+                  solver_parameters=mass_config.solver_parameters())
+            LocalProjection(self.H_DG, H).solve()
+
+    def get_thicksolver(self, dt=None):
+        """
+        Return a (cached) ThicknessSolver for the thickness equation defined in
+        def_thickadv_eq, for time step dt (by default self.dt), and the
+        projection of its solution onto H_DG
+
+        These are only rebuilt when the thickness equation is redefined.
+        """
+        thickadv = self.get_thickadv(dt)
+        key = float(self.dt if dt is None else dt)
+        if key not in self._thicksolvers:
+            a, L = lhs(thickadv), rhs(thickadv)
+            thicksolver = ThicknessSolver(
+                a == L, self.H, self.H_bcs,
+                solver_parameters=self.params.mass_solve.solver_parameters())
+            H_DG_proj = LocalProjection(self.H_DG, self.H)
+            self._thicksolvers[key] = (thicksolver, H_DG_proj)
+        return self._thicksolvers[key]
+
+    def mom_solve_due(self, mom_lag, H_mom):
+        """
+        Is a momentum solve due, mom_lag steps after the last one, at which the
+        thickness was H_mom (see TimeCfg.mom_solve_interval/mom_solve_dH_rtol)?
+        """
+        config = self.params.time
+        if mom_lag >= config.mom_solve_interval:
+            return True
+        if config.mom_solve_dH_rtol is None:
+            return False
+
+        dH = self.H_np.vector().copy()
+        dH.axpy(-1.0, H_mom)
+        dH_rel = dH.norm("l2") / H_mom.norm("l2")
+        return dH_rel > config.mom_solve_dH_rtol
 
     def timestep(self, adjoint_flag=1, qoi_func=None ):
         """
@@ -694,8 +982,20 @@ class ssa_solver:
 
         t = 0.0
 
+        # Times at which output is written (adaptive time stepping)
+        adaptive = config.adaptive_dt
+        if save_frequency > 0:
+            # Multiples of save_frequency (from integer counts, with a
+            # tolerance so that run_length is not repeated), then run_length
+            n_save = int(np.ceil(run_length / save_frequency - 1.0e-8)) - 1
+            t_save = save_frequency * np.arange(1, n_save + 1)
+            t_save = np.append(t_save, run_length)
+        else:
+            t_save = np.array([])
+
         # Initialize QoI structures
-        self.Qval_ts = np.zeros(n_steps+1)
+        Qval_ts = [0.0]
+        t_ts = [0.0]
         Q = Functional(name="Q")
         Q_is = []
 
@@ -704,12 +1004,14 @@ class ssa_solver:
         # H = self.H
         H_np = self.H_np
 
-        if adjoint_flag:
-            # Define QoI sampling times & configure checkpointing
-            num_sens = self.params.time.num_sens
-            t_sens = np.flip(np.linspace(run_length, 0, num_sens))
+        # Define QoI sampling times
+        num_sens = self.params.time.num_sens
+        t_sens = np.flip(np.linspace(run_length, 0, num_sens))
 
-            n_sens = np.round(t_sens/dt)
+        n_sens = np.round(t_sens/dt)
+
+        if adjoint_flag:
+            # Configure checkpointing
 
             reset_manager()
             clear_caches()
@@ -727,7 +1029,7 @@ class ssa_solver:
         # Initial QoI computation
         if qoi_func is not None:
             qoi = qoi_func()
-            self.Qval_ts[0] = assemble(qoi)
+            Qval_ts[0] = assemble(qoi)
 
         # Save QoI_0 if requested
         if adjoint_flag:
@@ -762,38 +1064,58 @@ class ssa_solver:
         ########################
         # Main timestepping loop
         ########################
-        for n in range(n_steps):
-            begin("Starting timestep %i of %i, time = %.16e a" % (n + 1, n_steps, t))
+        # Thickness at the last momentum solve, & steps since (lagged solves)
+        H_mom = H_np.vector().copy()
+        mom_lag = 0
+
+        t_events = np.unique(np.concatenate((t_sens, t_save, [run_length])))
+        t_events = t_events[t_events > 0.0]
+        for n, (t_next, dt_n) in enumerate(self.timestep_times(t_events)):
+            if adaptive:
+                begin("Starting timestep %i, time = %.16e a, dt = %.16e a" % (n + 1, t, dt_n))
+            else:
+                begin("Starting timestep %i of %i, time = %.16e a" % (n + 1, n_steps, t))
 
             # Solve
 
             # Simple Scheme
-            self.solve_thickadv_eq()
+            self.solve_thickadv_eq(dt_n)
             H_np.assign(self.H)
 
-            self.solve_mom_eq()
-            U_np.assign(self.U)
+            # Warm started from the previous step's velocity, and only every
+            # mom_solve_interval steps, or on a large thickness change
+            mom_lag += 1
+            if self.mom_solve_due(mom_lag, H_mom):
+                self.solve_mom_eq(warm=True)
+                U_np.assign(self.U)
+                H_mom = H_np.vector().copy()
+                mom_lag = 0
 
             # increment time
             n += 1
-            t = n * float(dt)
+            t = t_next
+            t_ts.append(t)
+            final = (t >= run_length) if adaptive else (n == n_steps)
 
             # Save QoI
             if qoi_func is not None:
                 qoi = qoi_func()
-                self.Qval_ts[n] = assemble(qoi)
+                Qval_ts.append(assemble(qoi))
 
                 if adjoint_flag:
-                    if n in n_sens:
+                    if (t in t_sens) if adaptive else (n in n_sens):
                         Q_i = Functional(name="Q_i")
                         Q_i.assign(qoi)
                         Q_is.append(Q_i)
                         Q.addto(Q_i.function())
+            else:
+                Qval_ts.append(0.0)
 
-            if n < n_steps and adjoint_flag:
+            if not final and adjoint_flag:
                 new_block()
 
-            if ((save_frequency>0) and (n%n_save_frequency==0)):
+            if (save_frequency > 0) and \
+               ((t in t_save) if adaptive else (n % n_save_frequency == 0)):
 
                 Hname = "H_timestep_" + str(n)
                 inout.write_variable(H_np, self.params, name=Hname, outdir=diag_dir, \
@@ -810,6 +1132,12 @@ class ssa_solver:
 
         # End of timestepping loop
 
+        self.Qval_ts = np.array(Qval_ts)
+        if adaptive:
+            self.t_ts = np.array(t_ts)
+        else:
+            self.t_ts = np.linspace(0, run_length, n_steps+1)
+
         return Q_is if qoi_func is not None else None
 
     # def forward_ts_alpha(self,aa):
@@ -821,7 +1149,7 @@ class ssa_solver:
     #     Q_vaf.assign(self.Q_vaf)
     #     return Q_vaf
 
-    def forward(self, f, *, verbose=False):
+    def forward(self, f, *, verbose=False, warm=False):
         """
         Run the forward model w/ controls 'f' and returns cost function 'J'
 
@@ -833,6 +1161,8 @@ class ssa_solver:
         rather than simply assigned to, because of how tlm_adjoint works.
         An annotated connection between 'f' and 'J' must be created, so
         self._alphaXbeta or _alpha, _beta must be set to f.
+
+        warm indicates that self.U holds a good initial guess for the velocity.
         """
         clear_caches()
 
@@ -843,8 +1173,11 @@ class ssa_solver:
         #     self.test_outfile = File(os.path.join('invoutput_data','alpha_test.pvd'))
         # self.test_outfile << self.alpha
 
-        self.def_mom_eq()
-        self.solve_mom_eq()
+        # The momentum equation need only be redefined if the controls
+        # themselves have changed (not just their values)
+        if not (self.params.momsolve.reuse_solver and self.mom_eq_current()):
+            self.def_mom_eq()
+        self.solve_mom_eq(warm=warm)
         J = self.comp_J_inv(verbose=verbose)
         return J
 
@@ -880,11 +1213,55 @@ class ssa_solver:
         config = self.params.inversion
 
         cntrl = self.get_control()
-        forward = self.forward
 
         if(config.verbose):
             inv_vals = []
 
+        # Velocity (& control values) at the last two accepted iterates,
+        # used to warm start the momentum solve, and the iteration counts of
+        # each momentum solve
+        warm_starts = []
+        mom_its = []
+        last_eval = [None]
+        n_evals = [1]
+        comm = self.mesh.mpi_comm()
+
+        def control_values(f):
+            if not isinstance(f, (list, tuple)):
+                f = [f]
+            return np.concatenate([function_get_values(fn) for fn in f])
+
+        def warm_start_U(f):
+            """Set the initial guess for the velocity at controls 'f'"""
+            m_k, U_k = warm_starts[-1]
+            self.U.assign(U_k, annotate=False)
+
+            if config.warm_start_extrapolate and len(warm_starts) > 1:
+                # Extrapolate along the last accepted step s = m_k - m_k-1,
+                # by the (clipped) projection of the trial step onto s
+                m_km1, U_km1 = warm_starts[-2]
+                s = m_k - m_km1
+                d = control_values(f) - m_k
+                s_d, s_s = comm.allreduce(np.array([s.dot(d), s.dot(s)]), op=MPI.SUM)
+                theta = min(max(s_d / s_s, 0.0), 1.0) if s_s > 0.0 else 0.0
+                self.U.vector().axpy(theta, U_k.vector())
+                self.U.vector().axpy(-theta, U_km1.vector())
+                function_update_state(self.U)
+
+        def forward(f):
+            warm = config.warm_start and len(warm_starts) > 0
+            if warm:
+                warm_start_U(f)
+            J = self.forward(f, warm=warm)
+            last_eval[0] = control_values(f)
+            mom_its.append(self.mom_iterations)
+            return J
+
+        def momentum_iterations(its):
+            picard = sum(i["picard"] for i in its)
+            newton = sum(i["newton"] for i in its)
+            return picard, newton
+
         reset_manager()
         clear_caches()
         start_manager()
@@ -922,6 +1299,20 @@ class ssa_solver:
             if(config.verbose):
                 info(f"Inversion inner iteration: {it}")
 
+            # Momentum solve iterations since the previous iteration
+            it_mom_its = mom_its[n_evals[0]:]
+            n_evals[0] = len(mom_its)
+            picard_its, newton_its = momentum_iterations(it_mom_its)
+            info(f"Momentum solve iterations: {len(it_mom_its)} evaluations, "
+                 f"picard {picard_its}, newton {newton_its}")
+
+            # The velocity was last solved for at the accepted iterate
+            if config.warm_start:
+                m_k = control_values(new_cc)
+                if last_eval[0] is not None and np.array_equal(m_k, last_eval[0]):
+                    warm_starts.append((m_k, self.U.copy(deepcopy=True)))
+                    del warm_starts[:-2]
+
             # Compute functional convergence
             f_criterion = ((old_J_val - new_J_val)
                            / max(abs(old_J_val), abs(new_J_val), 1.0))
@@ -949,7 +1340,8 @@ class ssa_solver:
                 converged = True
 
             if(config.verbose):
-                inv_vals.append((new_J_val, f_criterion, *g_criterion))
+                inv_vals.append((new_J_val, f_criterion, *g_criterion,
+                                 picard_its, newton_its))
 
             if it < config.min_iter:
                 converged = False
@@ -1109,9 +1501,15 @@ class ssa_solver:
         # copy control variables back to model
         self.update_model_fns()
 
+        picard_its, newton_its = momentum_iterations(mom_its)
+        info(f"Momentum solve iterations over {len(mom_its)} evaluations: "
+             f"picard {picard_its}, newton {newton_its}")
+
         if(config.verbose):
             info(f"Inversion terminated because {result[2]}")
-            inout.write_inversion_info(self.params, inv_vals)
+            inout.write_inversion_info(
+                self.params, inv_vals,
+                header="J, F_crit, G_crit_alpha, G_crit_beta, picard_its, newton_its")
 
         self.def_mom_eq()
 
@@ -1240,6 +1638,47 @@ class ssa_solver:
 #
 #        return melt_max
 
+    def interp_cache_key(self, x_coords, interp_space):
+        """
+        Hash identifying the observation interpolation operator: the mesh,
+        its partition, the interpolation space, the velocity file and the
+        observation points
+        """
+        mesh = interp_space.mesh()
+        comm = space_comm(interp_space)
+
+        local = hashlib.sha1()
+        local.update(np.ascontiguousarray(mesh.coordinates()).tobytes())
+        local.update(np.ascontiguousarray(mesh.cells()).tobytes())
+        local.update(np.asarray(mesh.topology().global_indices(0)).tobytes())
+        local.update(str(interp_space.ufl_element()).encode())
+
+        key = hashlib.sha1()
+        for digest in comm.allgather(local.hexdigest()):
+            key.update(digest.encode())
+        key.update(str(self.params.obs.vel_file).encode())
+        key.update(np.ascontiguousarray(x_coords, dtype=np.float64).tobytes())
+        return key.hexdigest()
+
+    def obs_interpolation_matrix(self, x_coords, interp_space):
+        """
+        Observation interpolation operator, read from and written to the
+        on-disk cache if params.obs.cache_interp_operator
+        """
+        if not self.params.obs.cache_interp_operator:
+            return interpolation_matrix(x_coords, interp_space)
+
+        comm = space_comm(interp_space)
+        key = self.interp_cache_key(x_coords, interp_space)
+        cached = inout.read_interp_operator(self.params, key, comm)
+        if cached is not None:
+            log.info(f"Read cached observation interpolation operator {key}")
+            return cached
+
+        obs_local, P = interpolation_matrix(x_coords, interp_space)
+        inout.write_interp_operator(self.params, key, comm, obs_local, P)
+        return obs_local, P
+
     def comp_J_inv(self, verbose=False):
         """
         Compute the value of the cost function
@@ -1298,7 +1737,8 @@ class ssa_solver:
             from tlm_adjoint.fenics.fenics_equations import LocalMatrix
             from scipy.sparse import spdiags
 
-            obs_local, P = interpolation_matrix(uv_obs_pts, interp_space)
+            obs_local, P = self.obs_interpolation_matrix(uv_obs_pts,
+                                                         interp_space)
 
             u_PRP = LocalMatrix(
                 P.T @ spdiags(1.0 / (u_std[obs_local] ** 2),
@@ -1384,17 +1824,13 @@ class ssa_solver:
         J.addto(J_ls_term_v)
 
         # Regularization
-        Prior = self.model.get_prior()
-        lap = Prior(self, self.Qp)
+        lap = self.get_prior()
 
         J_reg_alpha, J_reg_beta = lap.J_reg(alpha=alpha, beta=beta, beta_diff=betadiff)
 
         if do_alpha: J.addto(J_reg_alpha)
         if do_beta: J.addto(J_reg_beta)
 
-        # Get dict of regularisation components for e.g. L-curve analysis
-        J_reg_terms = lap.J_reg_terms(alpha=alpha, beta=beta, beta_diff=betadiff)
-
         # for block in manager()._blocks + [manager()._block]:
         #     for eq in block:
         #         if isinstance(eq, EquationSolver):
@@ -1414,13 +1850,16 @@ class ssa_solver:
             J2 = (function_scalar_value(J_ls_term_u)
                   + function_scalar_value(J_ls_term_v))
 
-            # Assemble & write out terms of regularisation term
+            # Get dict of regularisation components for e.g. L-curve analysis
+            J_reg_terms = lap.J_reg_terms(alpha=alpha, beta=beta,
+                                          beta_diff=betadiff)
+
+            # Write out terms of regularisation term
             J3 = 0.0
             J_fields = {}
             for term in J_reg_terms:
-                assembled = assemble(J_reg_terms[term])
-                J3 += assembled
-                J_fields[f"J_{term}"] = assembled
+                J3 += J_reg_terms[term]
+                J_fields[f"J_{term}"] = J_reg_terms[term]
 
             # Add params & full J terms to dict
             J_fields = {**J_fields, **{"delta_alpha": self.delta_alpha,
@@ -1432,10 +1871,6 @@ class ssa_solver:
                                        "J_ls": J2,
                                        "J_reg": J3}}
 
-            # Additional separate regularisation terms
-            for term in J_reg_terms:
-                J_fields[f"J_{term}"] = assemble(J_reg_terms[term])
-
             info('Inversion Details')
             for key in J_fields:
                 info(f"{key}: {J_fields[key]}")
@@ -1509,6 +1944,26 @@ class ssa_solver:
 
         self.ddJ = CachedHessian(J)
 
+    def hessian_block_action(self, cntrl, dms):
+        """
+        Hessian actions on a block of directions dms (a list of functions),
+        returning a list of (conjugate dual) functions.
+
+        Each action uses the CachedHessian (set_hessian_action), so that the
+        tangent-linear and adjoint solves are driven from the recorded forward,
+        which is not re-run. Assembly & solver caches, and the first order
+        adjoint, are shared across the block.
+        """
+        if type(cntrl) is list:
+            assert len(cntrl) == 1
+            cntrl = cntrl[0]
+
+        ddJ_vals = []
+        for dm in dms:
+            _, _, ddJ_val = self.ddJ.action(cntrl, dm)
+            ddJ_vals.append(ddJ_val)
+        return ddJ_vals
+
     def save_ts_zero(self):
         self.H_init = Function(self.H_np.function_space())
         self.U_init = Function(self.U.function_space())
@@ -1525,6 +1980,7 @@ class ssa_solver:
         self.H_np.assign(self.H_init, annotate=False)
         self.H.assign(self.H_init, annotate=False)
 
+
 # TODO - this isn't referenced anywhere
 class ddJ_wrapper(object):
     def __init__(self, ddJ_action, cntrl):
@@ -1538,17 +1994,376 @@ class ddJ_wrapper(object):
         return self.ddJ_action(self.ddJ_F).vector().get_local()
 
 
+class MomentumProblem(NonlinearProblem):
+    """
+    Nonlinear problem for the momentum equation
+
+    Residual and Jacobian forms are compiled once, and assembled (with
+    boundary conditions applied as in dolfin's NonlinearVariationalSolver)
+    into the tensors provided by the NewtonSolver, whose storage and sparsity
+    pattern are therefore reused between iterations and between solves.
+    """
+    def __init__(self, F, J, bcs, form_compiler_parameters=None):
+        NonlinearProblem.__init__(self)
+        if form_compiler_parameters is None:
+            form_compiler_parameters = {}
+        if not isinstance(F, Form):
+            F = Form(F, form_compiler_parameters=form_compiler_parameters)
+        self._F = F
+        self._J = Form(J, form_compiler_parameters=form_compiler_parameters)
+        self._bcs = bcs
+        self.residual_norms = []
+
+    def F(self, b, x):
+        backend_assemble(self._F, tensor=b)
+        for bc in self._bcs:
+            bc.apply(b, x)
+        self.residual_norms.append(b.norm("l2"))
+
+    def J(self, A, x):
+        backend_assemble(self._J, tensor=A)
+        for bc in self._bcs:
+            bc.apply(A)
+
+
+class MomentumNewtonSolver(NewtonSolver):
+    """
+    NewtonSolver for a stage of the momentum solve
+
+    If switch_rtol is not None, the solve additionally terminates once the
+    residual norm has been reduced by a factor switch_rtol (Picard stage).
+
+    If forcing (a dict of Eisenstat-Walker parameters, see MomsolveCfg) is
+    supplied and the linear solver is a Krylov method, the relative
+    tolerance of each linear solve is chosen from the nonlinear residual
+    history (inexact Newton), rather than fixed by the 'krylov_solver'
+    parameters, whose relative_tolerance instead acts as a lower bound.
+
+    If pc_rebuild_factor is not None and the linear solver is a Krylov
+    method, the preconditioner (e.g. the AMG hierarchy) is reused for
+    subsequent linear solves, including those of later calls to solve, and
+    only rebuilt once the Krylov iteration count exceeds pc_rebuild_factor
+    times the count of the first solve after the last rebuild. The counts
+    are compared per decade of residual reduction, so that solves at
+    different (e.g. Eisenstat-Walker) tolerances are comparable.
+    """
+    def __init__(self, comm, params, forcing=None, pc_rebuild_factor=None):
+        method = params.get("linear_solver", "default")
+        explicit = forcing is not None or pc_rebuild_factor is not None
+        if explicit and has_krylov_solver_method(method):
+            # Explicit Krylov solver, so that its tolerances & preconditioner
+            # reuse can be controlled
+            self.krylov_solver = PETScKrylovSolver(
+                comm, method, params.get("preconditioner", "default"))
+            self.krylov_solver.parameters.update(params.get("krylov_solver", {}))
+            NewtonSolver.__init__(self, comm, self.krylov_solver,
+                                  PETScFactory.instance())
+        else:
+            if explicit:
+                log.info("Inexact Newton & preconditioner reuse have no effect "
+                         f"with linear solver '{method}'")
+            self.krylov_solver = None
+            NewtonSolver.__init__(self, comm)
+        self.parameters.update(params)
+
+        self.switch_rtol = None
+        self.forcing = forcing if self.krylov_solver is not None else None
+        if self.forcing is not None:
+            # This stage's own Krylov tolerance is the lower bound
+            eta_min = params.get("krylov_solver", {}).get("relative_tolerance", 1.0e-8)
+            self.forcing = dict(self.forcing, eta_min=eta_min)
+        self._eta = None
+
+        self.pc_rebuild_factor = \
+            pc_rebuild_factor if self.krylov_solver is not None else None
+        self.pc_builds = 0
+        self._pc_its_ref = None
+        self._pc_rebuild = True
+
+    def converged(self, r, problem, iteration):
+        if NewtonSolver.converged(self, r, problem, iteration):
+            return True
+        norms = problem.residual_norms
+        return self.switch_rtol is not None and len(norms) > 1 \
+            and norms[-1] <= self.switch_rtol * norms[0]
+
+    def forcing_term(self, norms, iteration):
+        """Eisenstat-Walker (choice 2) forcing term for this iteration"""
+        ew = self.forcing
+        if iteration == 0 or len(norms) < 2 or self._eta is None:
+            eta = ew["eta0"]
+        else:
+            eta = ew["gamma"] * (norms[-1] / norms[-2]) ** ew["alpha"]
+            # Safeguard against the tolerance decreasing too quickly
+            eta_prev = ew["gamma"] * self._eta ** ew["alpha"]
+            if eta_prev > ew["threshold"]:
+                eta = max(eta, eta_prev)
+            eta = min(eta, ew["eta_max"])
+        return max(eta, ew["eta_min"])
+
+    def solver_setup(self, A, P, problem, iteration):
+        NewtonSolver.solver_setup(self, A, P, problem, iteration)
+
+        if self.forcing is not None:
+            self._eta = self.forcing_term(problem.residual_norms, iteration)
+            self.krylov_solver.parameters["relative_tolerance"] = self._eta
+            ksp = self.krylov_solver.ksp()
+            _, atol, dtol, max_it = ksp.getTolerances()
+            ksp.setTolerances(rtol=self._eta, atol=atol, divtol=dtol, max_it=max_it)
+
+        if self.pc_rebuild_factor is not None:
+            ksp = self.krylov_solver.ksp()
+            ksp.setConvergenceHistory(reset=True)
+            ksp.setReusePreconditioner(not self._pc_rebuild)
+            if self._pc_rebuild:
+                self.pc_builds += 1
+                self._pc_its_ref = None
+                self._pc_rebuild = False
+
+    def rebuild_preconditioner(self):
+        """Force a preconditioner rebuild at the next linear solve"""
+        self._pc_rebuild = True
+
+    def krylov_rate(self):
+        """
+        Krylov iterations per decade of residual reduction in the last linear
+        solve
+        """
+        ksp = self.krylov_solver.ksp()
+        its = ksp.getIterationNumber()
+        history = ksp.getConvergenceHistory()
+        if its == 0 or len(history) < 2 or not history[-1] > 0.0:
+            return float(its)
+        decades = np.log10(history[0] / history[-1])
+        return its / max(decades, 0.1)
+
+    def update_solution(self, x, dx, relaxation, problem, iteration):
+        if self.pc_rebuild_factor is not None:
+            # Rebuild the preconditioner for the next linear solve if this
+            # one took too many iterations (per decade of residual reduction)
+            rate = self.krylov_rate()
+            if self._pc_its_ref is None:
+                self._pc_its_ref = max(rate, 1.0)
+            elif rate > self.pc_rebuild_factor * self._pc_its_ref:
+                self._pc_rebuild = True
+
+        NewtonSolver.update_solution(self, x, dx, relaxation, problem, iteration)
+
+
+class MomentumNonlinearSolver:
+    """
+    Picard then Newton solution of the momentum equation F(x) = 0
+
+    The Picard stage uses the (inconsistent) Jacobian J_p, the Newton stage
+    the full Jacobian J. Each stage has its own MomentumProblem and dolfin
+    NewtonSolver, configured from the 'newton_solver' section of picard_params
+    and newton_params respectively, which persist between calls to solve.
+
+    If picard_switch_rtol is not None, the strategy is adaptive: the Picard
+    stage hands over to Newton once the residual has been reduced by a factor
+    picard_switch_rtol, and is skipped for warm started solves. If the Newton
+    stage fails, the initial guess is restored and the solve is retried (at
+    most newton_retries times) with a ten times tighter switch tolerance.
+
+    Only dolfin's 'newton' nonlinear solver is supported. MomentumSolver
+    falls back to dolfin's solve when none of these options are enabled.
+
+    If forcing is not None, both stages are solved inexactly, with
+    Eisenstat-Walker forcing terms. If pc_rebuild_factor is not None, each
+    stage lags its preconditioner (see MomentumNewtonSolver), so that with
+    a persistent MomentumNonlinearSolver the preconditioner is also reused
+    across solves.
+    """
+    def __init__(self, F, J_p, J, x, bcs, picard_params, newton_params,
+                 form_compiler_parameters=None, picard_switch_rtol=None,
+                 newton_retries=0, forcing=None, pc_rebuild_factor=None):
+        for params in (picard_params, newton_params):
+            if params.get("nonlinear_solver", "newton") != "newton":
+                raise NotImplementedError("Only the 'newton' nonlinear solver "
+                                          "is supported by MomentumNonlinearSolver")
+
+        if form_compiler_parameters is None:
+            form_compiler_parameters = {}
+        F = Form(F, form_compiler_parameters=form_compiler_parameters)
+        comm = x.function_space().mesh().mpi_comm()
+
+        self._x = x
+        self._bcs = bcs
+        self.picard_problem = MomentumProblem(F, J_p, bcs, form_compiler_parameters)
+        self.newton_problem = MomentumProblem(F, J, bcs, form_compiler_parameters)
+        self.picard_solver = MomentumNewtonSolver(
+            comm, picard_params["newton_solver"], forcing=forcing,
+            pc_rebuild_factor=pc_rebuild_factor)
+        self.newton_solver = MomentumNewtonSolver(
+            comm, newton_params["newton_solver"], forcing=forcing,
+            pc_rebuild_factor=pc_rebuild_factor)
+
+        self.picard_switch_rtol = picard_switch_rtol
+        self.newton_retries = newton_retries
+        # Failures are raised here (after any retries) rather than by dolfin
+        self._newton_error = \
+            newton_params["newton_solver"].get("error_on_nonconvergence", True)
+        if newton_retries > 0:
+            self.newton_solver.parameters["error_on_nonconvergence"] = False
+
+        self.iterations = {"picard": 0, "newton": 0, "krylov": 0}
+
+    def solve_picard(self, switch_rtol):
+        """Run the Picard stage, returning the number of iterations"""
+        self.picard_problem.residual_norms = []
+        self.picard_solver.switch_rtol = switch_rtol
+        # First order approx - inconsistent jacobian
+        its, _ = self.picard_solver.solve(self.picard_problem, self._x.vector())
+        self.iterations["krylov"] += self.picard_solver.krylov_iterations()
+        end()
+        return its
+
+    def solve_newton(self, final):
+        """Run the Newton stage, returning (iterations, converged)"""
+        self.newton_problem.residual_norms = []
+        try:
+            its, converged = self.newton_solver.solve(self.newton_problem,
+                                                      self._x.vector())
+        except RuntimeError:
+            # e.g. a failed linear solve
+            if final:
+                raise
+            its, converged = self.newton_solver.iteration(), False
+        self.iterations["krylov"] += self.newton_solver.krylov_iterations()
+        end()
+        return its, converged
+
+    def solve(self, warm=False):
+        """
+        Solve in place for x, returning the number of iterations per stage
+
+        warm indicates that x holds a good initial guess (e.g. a nearby
+        solution), in which case the adaptive strategy skips the Picard stage.
+        """
+        x_vec = self._x.vector()
+        for bc in self._bcs:
+            bc.apply(x_vec)
+
+        self.iterations = {"picard": 0, "newton": 0, "krylov": 0}
+        adaptive = self.picard_switch_rtol is not None
+        switch_rtol = self.picard_switch_rtol
+        skip_picard = adaptive and warm
+        if self.newton_retries > 0:
+            x0 = x_vec.copy()
+
+        for attempt in range(self.newton_retries + 1):
+            final = attempt == self.newton_retries
+            if attempt > 0:
+                x_vec.zero()
+                x_vec.axpy(1.0, x0)
+
+            if not skip_picard:
+                self.iterations["picard"] += self.solve_picard(switch_rtol)
+
+            # Newton solver
+            its, converged = self.solve_newton(final)
+            self.iterations["newton"] += its
+            if converged:
+                break
+
+            log.info(f"Newton solve failed to converge (attempt {attempt + 1})")
+            if final and self._newton_error:
+                raise RuntimeError("Momentum solve failed to converge after "
+                                   f"{attempt + 1} attempts")
+            skip_picard = False
+            self.picard_solver.rebuild_preconditioner()
+            self.newton_solver.rebuild_preconditioner()
+            if adaptive:
+                switch_rtol *= 0.1
+
+        return dict(self.iterations)
+
+
 class MomentumSolver(EquationSolver):
     def __init__(self, *args, **kwargs):
         self.picard_params = kwargs.pop("picard_params", None)
         self.J_p = kwargs.pop("J_p", None)
+        self.reuse = kwargs.pop("reuse", False)
+        self.picard_switch_rtol = kwargs.pop("picard_switch_rtol", None)
+        self.newton_retries = kwargs.pop("newton_retries", 0)
+        self.forcing = kwargs.pop("forcing", None)
+        self.pc_rebuild_factor = kwargs.pop("pc_rebuild_factor", None)
         super(MomentumSolver, self).__init__(*args, **kwargs)
+        self._nl_solver = None
+        self.iterations = None
+        # Set True if x holds a good initial guess for the next solve
+        self.warm_start = False
 
     def drop_references(self):
         super().drop_references()
         self.J_p = replaced_form(self.J_p)
+        self._nl_solver = None
+
+    def nonlinear_solver(self, x, deps=None):
+        """
+        Return a MomentumNonlinearSolver for x
+
+        If self.reuse, and the equation is being solved for its own solution
+        with its own dependencies, the MomentumNonlinearSolver is cached.
+        """
+        cacheable = self.reuse and deps is None and x is self.x()
+        if cacheable and self._nl_solver is not None:
+            return self._nl_solver
+
+        if deps is None:
+            def replace_deps(form):
+                return form
+        else:
+            replace_map = dict(zip(self.dependencies(), deps))
+            replace_map[self.x()] = x
+
+            def replace_deps(form):
+                return ufl.replace(form, replace_map)
+
+        F = replace_deps(self._lhs)
+        if isinstance(self._rhs, ufl.classes.Form):
+            F = F - replace_deps(self._rhs)
+        else:
+            assert isinstance(self._rhs, int) and self._rhs == 0
+        J_p = replace_deps(self.J_p)
+        J = replace_deps(self._J)
+
+        nl_solver = MomentumNonlinearSolver(
+            F, J_p, J, x, self._bcs, self.picard_params, self._solver_parameters,
+            form_compiler_parameters=self._form_compiler_parameters,
+            picard_switch_rtol=self.picard_switch_rtol,
+            newton_retries=self.newton_retries,
+            forcing=self.forcing,
+            pc_rebuild_factor=self.pc_rebuild_factor)
+        if cacheable:
+            self._nl_solver = nl_solver
+        return nl_solver
+
+    def legacy(self):
+        """
+        Are none of the MomentumNonlinearSolver options enabled? If so the
+        equation is solved with dolfin's NonlinearVariationalSolver, as Picard
+        then Newton, which supports any nonlinear_solver in picard_params &
+        the solver parameters, but does not report Krylov iteration counts.
+        """
+        return not self.reuse and self.picard_switch_rtol is None \
+            and self.newton_retries == 0 and self.forcing is None \
+            and self.pc_rebuild_factor is None
 
     def forward_solve(self, x, deps=None):
+        if self.legacy():
+            self.iterations = self.legacy_forward_solve(x, deps=deps)
+            return
+
+        nl_solver = self.nonlinear_solver(x, deps=deps)
+        # Recomputations (deps supplied) are always cold started
+        self.iterations = nl_solver.solve(warm=self.warm_start and deps is None)
+
+    def legacy_forward_solve(self, x, deps=None):
+        """
+        Solve as dolfin's solve would, returning the number of iterations per
+        stage (the Krylov iterations are not available, and are None)
+        """
         if deps is None:
             deps = self.dependencies()
 
@@ -1561,22 +2376,101 @@ class MomentumSolver(EquationSolver):
             def replace_deps(form):
                 return ufl.replace(form, replace_map)
 
-        lhs = replace_deps(self._lhs)
+        F = replace_deps(self._lhs)
         if isinstance(self._rhs, ufl.classes.Form):
-            rhs = replace_deps(self._rhs)
+            F = F - replace_deps(self._rhs)
         else:
-            rhs = self._rhs
-            assert isinstance(rhs, int) and rhs == 0
+            assert isinstance(self._rhs, int) and self._rhs == 0
         J_p = replace_deps(self.J_p)
         J = replace_deps(self._J)
-        # First order approx - inconsistent jacobian
-        solve(lhs == rhs, x, self._bcs, J=J_p,
-              form_compiler_parameters=self._form_compiler_parameters,
-              solver_parameters=self.picard_params)
-        end()
 
-        # Newton solver
-        solve(lhs == rhs, x, self._bcs, J=J,
-              form_compiler_parameters=self._form_compiler_parameters,
-              solver_parameters=self._solver_parameters)
-        end()
+        iterations = {"picard": None, "newton": None, "krylov": None}
+        # First order approx - inconsistent jacobian, then Newton solver
+        for stage, J_stage, solver_parameters in \
+                (("picard", J_p, self.picard_params),
+                 ("newton", J, self._solver_parameters)):
+            problem = backend_NonlinearVariationalProblem(
+                F, x, self._bcs, J_stage,
+                form_compiler_parameters=self._form_compiler_parameters)
+            nl_solver = backend_NonlinearVariationalSolver(problem)
+            nl_solver.parameters.update(solver_parameters)
+            iterations[stage], _ = nl_solver.solve()
+            end()
+
+        return iterations
+
+
+class ThicknessSolver(EquationSolver):
+    """
+    EquationSolver for the (linear) thickness equation a == L
+
+    The forward solve keeps its compiled forms, the assembled matrix and the
+    linear solver between calls. The matrix is re-assembled in place (so
+    that its sparsity pattern, and for LU the symbolic factorisation, are
+    reused) only when the state of one of its coefficients (e.g. U_np), or
+    the value of one of its constants (e.g. dt), has changed. Recomputations
+    with supplied dependencies use the default EquationSolver forward solve.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ThicknessSolver, self).__init__(*args, **kwargs)
+        self._linear_solver = None
+
+    def drop_references(self):
+        super().drop_references()
+        self._linear_solver = None
+
+    def _init_linear_solver(self, x):
+        fcp = self._form_compiler_parameters
+        if fcp is None:
+            fcp = {}
+        self._a = Form(self._lhs, form_compiler_parameters=fcp)
+        self._L = Form(self._rhs, form_compiler_parameters=fcp)
+        self._A = PETScMatrix()
+        self._b = PETScVector()
+        self._A_coeffs = self._lhs.coefficients()
+        self._A_state = None
+
+        comm = x.function_space().mesh().mpi_comm()
+        params = self._solver_parameters
+        method = params.get("linear_solver", "default")
+        if has_krylov_solver_method(method):
+            self._linear_solver = PETScKrylovSolver(
+                comm, method, params.get("preconditioner", "default"))
+            self._linear_solver.parameters.update(params.get("krylov_solver", {}))
+        else:
+            if method in ["lu", "direct"]:
+                method = "default"
+            self._linear_solver = PETScLUSolver(comm, method)
+
+    def _A_current_state(self):
+        state = []
+        for c in self._A_coeffs:
+            if isinstance(c, backend_Constant):
+                state.append(tuple(c.values()))
+            elif is_function(c):
+                state.append(function_state(c))
+            else:
+                return None  # always re-assemble
+        return tuple(state)
+
+    def forward_solve(self, x, deps=None):
+        if deps is not None or x is not self.x():
+            super().forward_solve(x, deps=deps)
+            return
+
+        if self._linear_solver is None:
+            self._init_linear_solver(x)
+
+        A_state = self._A_current_state()
+        if A_state is None or A_state != self._A_state:
+            backend_assemble(self._a, tensor=self._A)
+            for bc in self._bcs:
+                bc.apply(self._A)
+            self._linear_solver.set_operator(self._A)
+            self._A_state = A_state
+
+        backend_assemble(self._L, tensor=self._b)
+        for bc in self._bcs:
+            bc.apply(self._b)
+
+        self._linear_solver.solve(x.vector(), self._b)
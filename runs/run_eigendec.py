@@ -17,7 +17,7 @@
 
 #!/usr/bin/env python
 
-from fenics_ice.backend import Function, Vector, function_get_values
+from fenics_ice.backend import Function, Vector
 
 import os
 os.environ["OMP_NUM_THREADS"] = "1"
@@ -106,46 +106,78 @@ def run_eigendec(config_file):
     # @timer
     def ghep_action(x):
         """Hessian action w/o preconditioning"""
-        _, _, ddJ_val = slvr.ddJ.action(cntrl, x)
+        ddJ_val, = slvr.hessian_block_action(cntrl, [x])
         # reg_op.inv_action(ddJ_val.vector(), xg.vector()) <- gnhep_prior
-        return function_get_values(ddJ_val)
+        return ddJ_val
 
     @count_calls()
     def prior_action(x):
         """Define the action of the B matrix (prior)"""
         reg_op.action(x.vector(), xg.vector())
-        return function_get_values(xg)
+        return xg
 
     # opts = {'prior': gnhep_prior_action, 'mass': gnhep_mass_action}
     # gnhep_func = opts[params.eigendec.precondition_by]
 
     num_eig = params.eigendec.num_eig
-    n_iter = params.eigendec.power_iter  # <- not used yet
+    n_iter = params.eigendec.power_iter  # random algorithm only
 
     # Hessian eigendecomposition using SLEPSc
     eig_algo = params.eigendec.eig_algo
     if eig_algo == "slepc":
         results = {}  # Create this empty dict & pass it to slepc_monitor_callback to fill
-        # Eigendecomposition
-        import slepc4py.SLEPc as SLEPc
-        esolver = eigendecompose(space,
-                                 ghep_action,
-                                 tolerance=params.eigendec.tol,
-                                 max_it=params.eigendec.max_iter,
-                                 N_eigenvalues=num_eig,
-                                 problem_type=SLEPc.EPS.ProblemType.GHEP,
-                                 solver_type=SLEPc.EPS.Type.KRYLOVSCHUR,
-                                 configure=slepc_config_callback(prior_action, space,
-                                                                 prior_pc=prior.LaplacianPC(reg_op)),
-                                 monitor=slepc_monitor_callback(params, space, results))
+
+        # Previously converged eigenpairs, which are kept & deflated
+        restart = None
+        if params.eigendec.restart:
+            restart = ED.read_eigendecomposition(params, space)
+            log.info(f"Restarting eigendecomposition with {len(restart[1])} "
+                     "previously converged eigenpairs")
+            if num_eig is None:
+                raise ValueError("Restarting the eigendecomposition requires num_eig")
+
+        n_prev = 0 if restart is None else len(restart[1])
+        monitor = slepc_monitor_callback(params, space, results, restart=restart)
+
+        # Optionally stop once the eigenvalues are small enough
+        stopping = None
+        if params.eigendec.stop_at_thresh or params.eigendec.trace_rtol is not None:
+            stopping = ED.slepc_stopping_callback(
+                params, lam_prev=[] if restart is None else restart[0])
+
+        esolver = None
+        if num_eig is None or n_prev < num_eig:
+            # Eigendecomposition
+            import slepc4py.SLEPc as SLEPc
+            esolver = eigendecompose(space,
+                                     ghep_action,
+                                     tolerance=params.eigendec.tol,
+                                     max_it=params.eigendec.max_iter,
+                                     N_eigenvalues=None if num_eig is None else num_eig - n_prev,
+                                     problem_type=SLEPc.EPS.ProblemType.GHEP,
+                                     solver_type=SLEPc.EPS.Type.KRYLOVSCHUR,
+                                     configure=slepc_config_callback(
+                                         prior_action, space,
+                                         prior_pc=prior.LaplacianPC(reg_op)),
+                                     monitor=monitor,
+                                     deflation_space=None if restart is None else restart[1],
+                                     stopping=stopping)
 
         log.info("Finished eigendecomposition")
         vr = results['vr']
         lam = results['lam']
 
+        if len(vr) < len(lam):
+            # Terminated early: record only the eigenvalues found
+            lam = lam[:len(vr)]
+            results['lam'] = lam
+            ED.write_eigenvalues(params, lam, ED.eigendec_output_paths(params)[2])
+            num_eig = len(vr)
+
         # Check the eigenvectors & eigenvalues
         if(params.eigendec.test_ed):
-            ED.test_eigendecomposition(esolver, results, space, params)
+            if esolver is not None:
+                ED.test_eigendecomposition(esolver, results, space, params)
 
             if num_eig > 100:
                 log.warning("Requesting inner product of more than 100 EVs, this is expensive!")
@@ -175,6 +207,41 @@ def run_eigendec(config_file):
         #     v.rename('v', v.label())
         #     vtkfile << v
 
+    elif eig_algo == "random":
+        block_size = params.eigendec.hessian_block_size
+
+        def ghep_block_action(xs):
+            """Hessian action on a block of vectors"""
+            ddJ_vals = []
+            for i in range(0, len(xs), block_size):
+                ddJ_vals.extend(slvr.hessian_block_action(cntrl, xs[i:i + block_size]))
+            return ddJ_vals
+
+        # Randomised double pass eigendecomposition, with the prior
+        # (inverse) action for the B (inverse) inner product
+        lam, vr = ED.randomized_eigendecompose(
+            space,
+            ghep_block_action,
+            reg_op.action,
+            reg_op.inv_action,
+            num_eig,
+            oversampling=params.eigendec.oversampling,
+            n_power_iter=n_iter,
+            seed=params.constants.random_seed)
+
+        log.info("Finished eigendecomposition")
+        ED.write_eigendecomposition(params, space, lam, vr)
+
+        if params.eigendec.test_ed:
+            # Check for B orthonormality
+            for i in range(num_eig):
+                reg_op.action(vr[i].vector(), xg.vector())
+                for j in range(i, num_eig):
+                    inn = xg.vector().inner(Vector(vr[j].vector()))
+                    expected = 1.0 if i == j else 0.0
+                    if abs(inn - expected) > params.eigendec.tol:
+                        raise Exception(f"Eigenvectors {i} & {j} inner product is {inn}")
+
     else:
         raise NotImplementedError
 
@@ -16,6 +16,7 @@
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
 from fenics_ice.backend import Function, HDF5File
+from fenics_ice.posterior import LowRankPosteriorCovariance
 
 import os
 os.environ["OMP_NUM_THREADS"] = "1"
@@ -50,20 +51,11 @@ def run_errorprop(config_file):
     # Load the static model data (geometry, smb, etc)
     input_data = inout.InputData(params)
 
-    # Eigen decomposition params
-    phase_eigen = params.eigendec.phase_name
-    phase_suffix_e = params.eigendec.phase_suffix
-    lamfile = params.io.eigenvalue_file
-    vecfile = params.io.eigenvecs_file
-
     # Qoi forward params
     phase_time = params.time.phase_name
     phase_suffix_qoi = params.time.phase_suffix
     dqoi_h5file = params.io.dqoi_h5file
 
-    if len(phase_suffix_e) > 0:
-        lamfile = params.io.run_name + phase_suffix_e + '_eigvals.p'
-        vecfile = params.io.run_name + phase_suffix_e + '_vr.h5'
     if len(phase_suffix_qoi) > 0:
         dqoi_h5file = params.io.run_name + phase_suffix_qoi + '_dQ_ts.h5'
 
@@ -88,93 +80,60 @@ def run_errorprop(config_file):
     Prior = mdl.get_prior()
     reg_op = Prior(slvr, space)
 
-    # Loads eigenvalues from file
-    outdir_e = Path(outdir)/phase_eigen/phase_suffix_e
-    with open(outdir_e/lamfile, 'rb') as ff:
-        eigendata = pickle.load(ff)
-        lam = eigendata[0].real.astype(np.float64)
-        nlam = len(lam)
-
-    # Check if eigendecomposition successfully produced num_eig
-    # or if some are NaN
-    if np.any(np.isnan(lam)):
-        raise RuntimeError("NaN eigenvalue(s)")
-
-    # and eigenvectors from .h5 file
-    eps = params.constants.float_eps
-    W = []
-    with HDF5File(MPI.COMM_WORLD, str(outdir_e/vecfile), 'r') as hdf5data:
-        for i in range(nlam):
-            w = Function(space)
-            hdf5data.read(w, f'v/vector_{i}')
-
-            # Test squared norm in prior == 1.0
-            B_inv_w = Function(space, space_type="conjugate_dual")
-            reg_op.action(w.vector(), B_inv_w.vector())
-            norm_sq_in_prior = w.vector().inner(B_inv_w.vector())
-            assert (abs(norm_sq_in_prior - 1.0) < eps)
-            del B_inv_w
-
-            W.append(w)
-
-    D = np.diag(lam / (lam + 1))  # D_r Isaac 20
+    # Loads eigenvalues & eigenvectors, and defines the low-rank posterior
+    # covariance
+    post_cov = LowRankPosteriorCovariance.from_eigendec(params, reg_op)
+    lam = post_cov.lam
+    nlam = len(lam)
 
     # File containing dQoi_dCntrl (i.e. Jacobian of parameter to observable (Qoi))
     outdir_qoi = Path(outdir)/phase_time/phase_suffix_qoi
     hdf5data = HDF5File(MPI.COMM_WORLD, str(outdir_qoi/dqoi_h5file), 'r')
 
-    dQ_cntrl = Function(space, space_type="conjugate_dual")
-
     run_length = params.time.run_length
     num_sens = params.time.num_sens
     t_sens = np.flip(np.linspace(run_length, 0, num_sens))
     sigma = np.zeros(num_sens)
     sigma_prior = np.zeros(num_sens)
 
-    for j in range(num_sens):
-        hdf5data.read(dQ_cntrl, f'dQd{cntrl.name()}/vector_{j}')
-
-        tmp1 = np.asarray([w.vector().inner(dQ_cntrl.vector()) for w in W])
-        tmp2 = np.dot(D, tmp1)
-
-        P1 = Function(space)
-        for tmp, w in zip(tmp2, W):
-            P1.vector().axpy(tmp, w.vector())
-
-        P2 = Function(space)
-        reg_op.inv_action(dQ_cntrl.vector(), P2.vector())
+    # Sensitivities are processed in blocks: one W^T dQ product and one
+    # block of prior solves per block
+    block_size = params.error_prop.sens_block_size
+    if block_size == 0:
+        block_size = max(num_sens, 1)
 
-        P_vec = P2.vector() - P1.vector()
+    for j0 in range(0, num_sens, block_size):
+        dQ_block = []
+        for j in range(j0, min(j0 + block_size, num_sens)):
+            dQ_cntrl = Function(space, space_type="conjugate_dual")
+            hdf5data.read(dQ_cntrl, f'dQd{cntrl.name()}/vector_{j}')
+            dQ_block.append(dQ_cntrl)
 
-        variance = P_vec.inner(dQ_cntrl.vector())
-        sigma[j] = np.sqrt(variance)
+        variance, variance_prior, WtdQ = \
+            post_cov.variance_block(dQ_block, return_inner=True)
+        sigma[j0:j0 + len(dQ_block)] = np.sqrt(variance)
 
         # Prior only
-        variance_prior = P2.vector().inner(dQ_cntrl.vector())
-        sigma_prior[j] = np.sqrt(variance_prior)
+        sigma_prior[j0:j0 + len(dQ_block)] = np.sqrt(variance_prior)
 
     # Look at the last sampled time and check how sigma QoI converges
     # with addition of more eigenvectors
 
     sigma_conv = []
     sigma_steps = []
-    P1 = Function(space)
 
     # How many steps?
     conv_res = 100
     conv_int = int(np.ceil(nlam/conv_res))
 
-    for i in range(0, nlam, conv_int):
-
-        # Reuse tmp1/tmp2 from above because its the last sens
-        for j in range(i, min(i+conv_int, nlam)):
-            P1.vector().axpy(tmp2[j], W[j].vector())
+    # Reuse the last sens: variance reduction from the first n eigenpairs
+    reduction = np.cumsum(post_cov.D * WtdQ[:, -1] ** 2)
 
-        P_vec = P2.vector() - P1.vector()
-
-        variance = P_vec.inner(dQ_cntrl.vector())
+    for i in range(0, nlam, conv_int):
+        i_end = min(i+conv_int, nlam)
+        variance = variance_prior[-1] - reduction[i_end - 1]
         sigma_conv.append(np.sqrt(variance))
-        sigma_steps.append(min(i+conv_int, nlam))
+        sigma_steps.append(i_end)
 
     # Save plots in diagnostics
     phase_err = params.error_prop.phase_name
@@ -16,15 +16,14 @@
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
 from fenics_ice.backend import FiniteElement, Function, FunctionSpace, \
-    HDF5File, TestFunction, assemble, assign, inner, dx
+    TestFunction, assemble, assign, inner, dx
+from fenics_ice.posterior import LowRankPosteriorCovariance
 
 import os
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["OPENBLAS_NUM_THREADS"] = "1"
 
 import mpi4py.MPI as MPI  # noqa: N817
-from pathlib import Path
-import pickle
 import numpy as np
 import sys
 
@@ -115,8 +114,6 @@ def patch_fun(mesh_in, params):
 def run_invsigma(config_file):
     """Compute control sigma values from eigendecomposition"""
 
-    comm = MPI.COMM_WORLD
-
     # Read run config file
     params = ConfigParser(config_file)
 
@@ -129,16 +126,6 @@ def run_invsigma(config_file):
     # Load the static model data (geometry, smb, etc)
     input_data = inout.InputData(params)
 
-    # Eigen decomposition params
-    phase_suffix_e = params.eigendec.phase_suffix
-    eigendir = Path(outdir)/params.eigendec.phase_name/phase_suffix_e
-    lamfile = params.io.eigenvalue_file
-    vecfile = params.io.eigenvecs_file
-
-    if len(phase_suffix_e) > 0:
-        lamfile = params.io.run_name + phase_suffix_e + '_eigvals.p'
-        vecfile = params.io.run_name + phase_suffix_e + '_vr.h5'
-
     # Get model mesh
     mesh = fice_mesh.get_mesh(params)
 
@@ -155,41 +142,12 @@ def run_invsigma(config_file):
 
     space = slvr.get_control_space()
 
-    x, y, z = [Function(space) for i in range(3)]
     # Regularization operator using inversion delta/gamma values
     Prior = mdl.get_prior()
     reg_op = Prior(slvr, space)
 
-    # Loads eigenvalues from file
-    with open(os.path.join(eigendir, lamfile), 'rb') as ff:
-        eigendata = pickle.load(ff)
-        lam = eigendata[0].real.astype(np.float64)
-        nlam = len(lam)
-
-    # Check if eigendecomposition successfully produced num_eig
-    # or if some are NaN
-    if np.any(np.isnan(lam)):
-        raise RuntimeError("NaN eigenvalue(s)")
-
-    # and eigenvectors from .h5 file
-    eps = params.constants.float_eps
-    W = []
-    with HDF5File(comm,
-                  os.path.join(eigendir, vecfile), 'r') as hdf5data:
-        for i in range(nlam):
-            w = Function(space)
-            hdf5data.read(w, f'v/vector_{i}')
-
-            # Test squared norm in prior == 1.0
-            B_inv_w = Function(space, space_type="conjugate_dual")
-            reg_op.action(w.vector(), B_inv_w.vector())
-            norm_sq_in_prior = w.vector().inner(B_inv_w.vector())
-            assert (abs(norm_sq_in_prior - 1.0) < eps)
-            del B_inv_w
-
-            W.append(w)
-
-    D = np.diag(lam / (lam + 1))  # D_r Isaac 20
+    # Low-rank posterior covariance from the eigendecomposition
+    post_cov = LowRankPosteriorCovariance.from_eigendec(params, reg_op)
 
     # TODO make this a model method
     cntrl_names = []
@@ -226,7 +184,40 @@ def run_invsigma(config_file):
 
     test = TestFunction(space)
 
+    # Patch functionals are processed in batches, so that each batch needs
+    # only one pass through the eigenvectors (see StreamedEigenBasis)
+    block_size = params.inv_sigma.patch_block_size
+    batch = []
+
     neg_flag = 0
+
+    def process_batch():
+        nonlocal neg_flag
+
+        # Prior variance P_i^T Gamma_prior P_i, less P_i^T W D W^T P_i
+        # P_i is clust_lump
+        cov_posts, cov_priors = post_cov.variance_block(
+            [clust_lump for _, _, clust_lump in batch])
+
+        for (i, j, _), cov_post, cov_prior in zip(batch, cov_posts, cov_priors):
+            if cov_post < 0:
+                log.warning(f'WARNING: Negative Sigma: {cov_post}')
+                log.warning('Setting as Zero and Continuing.')
+                neg_flag = 1
+                continue
+
+            # NB: "+=" here but each DOF will only be contributed to *once*
+            # Essentially we are constructing the sigmas functions from
+            # non-overlapping patches.
+            indic_i = (clust_fun.vector()[:] == i).astype(int)
+            sigmas[j].vector()[:] += indic_i * np.sqrt(cov_post)
+            sigmas[j].vector().apply("insert")
+
+            sigma_priors[j].vector()[:] += indic_i * np.sqrt(cov_prior)
+            sigma_priors[j].vector().apply("insert")
+
+        batch.clear()
+
     for i in range(npatches):
 
         print(f"Working on patch {i+1} of {npatches}")
@@ -250,38 +241,12 @@ def run_invsigma(config_file):
 
             clust_lump /= patch_area
 
-            # Prior variance
-            reg_op.inv_action(clust_lump, x.vector())
-            cov_prior = x.vector().inner(clust_lump)
-
-            # P_i^T W D W^T P_i
-            # P_i is clust_lump
-            # P_i^T has dims [1 x M], W has dims [M x N]
-            # where N is num eigs & M is size of ev function space
-            PiW = np.asarray([clust_lump.inner(w.vector()) for w in W])
-
-            # PiW & PiWD are [1 x N]
-            PiWD = PiW * D.diagonal()
-            # PiWDWPi, [1 x N] * [N x 1]
-            PiWDWPi = np.inner(PiWD, PiW)  # np.inner OK here because already parallel reduced
-
-            cov_reduction = PiWDWPi
-            cov_post = cov_prior - cov_reduction
-
-            if cov_post < 0:
-                log.warning(f'WARNING: Negative Sigma: {cov_post}')
-                log.warning('Setting as Zero and Continuing.')
-                neg_flag = 1
-                continue
-
-            # NB: "+=" here but each DOF will only be contributed to *once*
-            # Essentially we are constructing the sigmas functions from
-            # non-overlapping patches.
-            sigmas[j].vector()[:] += indic_1.vector()[:] * np.sqrt(cov_post)
-            sigmas[j].vector().apply("insert")
+            batch.append((i, j, clust_lump))
+            if len(batch) == block_size:
+                process_batch()
 
-            sigma_priors[j].vector()[:] += indic_1.vector()[:] * np.sqrt(cov_prior)
-            sigma_priors[j].vector().apply("insert")
+    if len(batch) > 0:
+        process_batch()
 
     if neg_flag:
         log.warning('Negative value(s) of sigma encountered')
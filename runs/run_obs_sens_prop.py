@@ -30,6 +30,7 @@ import sys
 
 from fenics_ice import model, solver, inout
 from fenics_ice import mesh as fice_mesh
+from fenics_ice.posterior import LowRankPosteriorCovariance
 from fenics_ice.config import ConfigParser
 from ufl import split
 from fenics_ice.solver import Amat_obs_action
@@ -44,16 +45,18 @@ os.environ["OPENBLAS_NUM_THREADS"] = "1"
 
 # the function below is not in run_errorprop.py, but needed for obs sens
 @restore_manager
-def compute_tau(forward, u, m, dm):
+def compute_tau(forward, u, m, dms):
     # this block of code will do the "forward" (calculation of velocity and cost function) once
-    # and then find the jacobian of u in the direction needed
+    # and then find the jacobian of u in each of the directions needed
+    # (one tangent-linear per direction, all in the same forward pass)
     set_manager(EquationManager(cp_method="none", cp_parameters={}))
     stop_manager()
 
     start_manager(tlm=True)
-    configure_tlm((m, dm))
+    for dm in dms:
+        configure_tlm((m, dm))
     forward(m)
-    return function_tlm(u, (m, dm))        
+    return [function_tlm(u, (m, dm)) for dm in dms]
 
 
 def run_obs_sens_prop(config_file):
@@ -71,20 +74,11 @@ def run_obs_sens_prop(config_file):
     # Load the static model data (geometry, smb, etc)
     input_data = inout.InputData(params)
 
-    # Eigen decomposition params
-    phase_eigen = params.eigendec.phase_name
-    phase_suffix_e = params.eigendec.phase_suffix
-    lamfile = params.io.eigenvalue_file
-    vecfile = params.io.eigenvecs_file
-
     # Qoi forward params
     phase_time = params.time.phase_name
     phase_suffix_qoi = params.time.phase_suffix
     dqoi_h5file = params.io.dqoi_h5file
 
-    if len(phase_suffix_e) > 0:
-        lamfile = params.io.run_name + phase_suffix_e + '_eigvals.p'
-        vecfile = params.io.run_name + phase_suffix_e + '_vr.h5'
     if len(phase_suffix_qoi) > 0:
         dqoi_h5file = params.io.run_name + phase_suffix_qoi + '_dQ_ts.h5'
 
@@ -112,36 +106,8 @@ def run_obs_sens_prop(config_file):
     Prior = mdl.get_prior()
     reg_op = Prior(slvr, space)
 
-    # Loads eigenvalues from file
-    outdir_e = Path(outdir)/phase_eigen/phase_suffix_e
-    with open(outdir_e/lamfile, 'rb') as ff:
-        eigendata = pickle.load(ff)
-        lam = eigendata[0].real.astype(np.float64)
-        nlam = len(lam)
-
-    # Check if eigendecomposition successfully produced num_eig
-    # or if some are NaN
-    if np.any(np.isnan(lam)):
-        raise RuntimeError("NaN eigenvalue(s)")
-
-    # and eigenvectors from .h5 file
-    eps = params.constants.float_eps
-    W = []
-    with HDF5File(MPI.COMM_WORLD, str(outdir_e/vecfile), 'r') as hdf5data:
-        for i in range(nlam):
-            w = Function(space)
-            hdf5data.read(w, f'v/vector_{i}')
-
-            # Test squared norm in prior == 1.0
-            B_inv_w = Function(space, space_type="conjugate_dual")
-            reg_op.action(w.vector(), B_inv_w.vector())
-            norm_sq_in_prior = w.vector().inner(B_inv_w.vector())
-            assert (abs(norm_sq_in_prior - 1.0) < eps)
-            del B_inv_w
-
-            W.append(w)
-
-    D = np.diag(lam / (lam + 1))  # D_r Isaac 20
+    # Low-rank posterior covariance from the eigendecomposition
+    post_cov = LowRankPosteriorCovariance.from_eigendec(params, reg_op)
 
     # File containing dQoi_dCntrl (i.e. Jacobian of parameter to observable (Qoi))
     outdir_qoi = Path(outdir)/phase_time/phase_suffix_qoi
@@ -185,37 +151,22 @@ def run_obs_sens_prop(config_file):
     size = comm.Get_size()
     rank = comm.Get_rank()
 
+    P3s = []
     for j in range(num_sens):
 
         # for each time level T, we have a Q_T, hence the loop
             
         hdf5data.read(dQ_cntrl, f'dQd{cntrl[0].name()}/vector_{j}')
 
-        # the rest of this loop implements the same operations as 
-        # lines 137-147 of run_errorprop.py, ie
-        #
-        #   (Gamma_{prior} - W D W^T) acting on (dQ/dm)
-        #
-        # P3 needed to be defined as it is because
-        # P_vec = P2.vector() - P1.vector() led to errors later on (cannot recall specifics)
-            
-        tmp1 = np.asarray([w.vector().inner(dQ_cntrl.vector()) for w in W])
-        tmp2 = np.dot(D, tmp1)
-
-        P1 = Function(space)
-        for tmp, w in zip(tmp2, W):
-            P1.vector().axpy(tmp, w.vector())
+        # (Gamma_{prior} - W D W^T) acting on (dQ/dm)
+        P3s.append(post_cov.apply(dQ_cntrl))
 
-        P2 = Function(space)
-        reg_op.inv_action(dQ_cntrl.vector(), P2.vector())
-
-        P3 = Function(space)
-        P3.vector()[:] = P2.vector()[:] - P1.vector()[:]
-        
+    # tau is  d(U,V)/dm * (Gamma_{prior} - W D W^T) * (dQ/dm), or
+    #         d(U,V)/dm * P3
+    # for all time levels from a single forward pass
+    taus = compute_tau(slvr.forward, slvr.U, cntrl, P3s)
 
-        # tau is  d(U,V)/dm * (Gamma_{prior} - W D W^T) * (dQ/dm), or
-        #         d(U,V)/dm * P3
-        tau = compute_tau(slvr.forward, slvr.U, cntrl, P3)
+    for j, tau in enumerate(taus):
 
         # tau is in the space of U (right?)
         tauu, tauv = split(tau)
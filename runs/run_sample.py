@@ -15,17 +15,15 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
-from fenics_ice.backend import Function, HDF5File, project
+from fenics_ice.backend import Function, project
+from fenics_ice.posterior import LowRankPosteriorCovariance
 
 import os
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["OPENBLAS_NUM_THREADS"] = "1"
 
-import mpi4py.MPI as MPI  # noqa: N817
 import sys
 import numpy as np
-import pickle
-from pathlib import Path
 
 from fenics_ice import model, solver, prior, inout
 from fenics_ice import mesh as fice_mesh
@@ -53,28 +51,14 @@ def run_sample(config_file):
     phase_name_sample = params.sample.phase_name
     phase_suffix_sample = params.sample.phase_suffix
 
-    outdir = params.io.output_dir
     diag_dir = params.io.diagnostics_dir
 
     # Load the static model data (geometry, smb, etc)
     input_data = inout.InputData(params)
 
     #Eigen value params
-    phase_name_e = params.eigendec.phase_name
-    phase_suffix_e = params.eigendec.phase_suffix
-    lamfile = params.io.eigenvalue_file
-    vecfile = params.io.eigenvecs_file
     threshlam = params.eigendec.eigenvalue_thresh
 
-    # Qoi forward params
-    phase_time = params.time.phase_name
-    phase_suffix_qoi = params.time.phase_suffix
-    dqoi_h5file = params.io.dqoi_h5file
-
-    if len(phase_suffix_e) > 0:
-        lamfile = params.io.run_name + phase_suffix_e + '_eigvals.p'
-        vecfile = params.io.run_name + phase_suffix_e + '_vr.h5'
-
     # Get model mesh
     mesh = fice_mesh.get_mesh(params)
 
@@ -98,58 +82,18 @@ def run_sample(config_file):
 
     if (sample_posterior):
 
-        # Loads eigenvalues from file
-        outdir_e = Path(outdir)/phase_name_e/phase_suffix_e
-        with open(outdir_e/lamfile, 'rb') as ff:
-            eigendata = pickle.load(ff)
-            lam = eigendata[0].real.astype(np.float64)
-            nlam = len(lam)
-
-
-        # Check if eigendecomposition successfully produced num_eig
-        # or if some are NaN
-        if np.any(np.isnan(lam)):
-            nlam = np.argwhere(np.isnan(lam))[0][0]
-            lam = lam[:nlam]
-
-        # and eigenvectors from .h5 file
-        eps = params.constants.float_eps
-        W = []
-
-        max_lam = params.sample.num_eigenvals
-        if (max_lam > 0):
-            lam = lam[:max_lam] 
-
-        y = Function(space)
-        with HDF5File(MPI.COMM_WORLD, str(outdir_e/vecfile), 'r') as hdf5data:
-            for i in range(len(lam)):
-                w = Function(space)
-                hdf5data.read(w, f'v/vector_{i}')
-
-                # Test norm in prior == 1.0
-                reg_op.action(w.vector(), y.vector())
-                norm_in_prior = w.vector().inner(y.vector())
-                assert (abs(norm_in_prior - 1.0) < eps)
-
-                W.append(w)
-
-
-      # take only the largest eigenvalues
-        pind = np.flatnonzero(lam > threshlam)
-        lam = lam[pind]
-        nlam = len(lam)
-        W = [W[i] for i in pind]
-
-### ABOVE THIS POINT CODE IS BORROWED FROM RUN_ERRORPROP.PY
-
-        D = np.diag(1 / np.sqrt(lam + 1) - 1)  
+        # Low-rank posterior covariance from the (converged) eigenpairs,
+        # keeping only the largest eigenvalues
+        post_cov = LowRankPosteriorCovariance.from_eigendec(
+            params, reg_op, max_eig=params.sample.num_eigenvals,
+            eigenvalue_thresh=threshlam, truncate_nan=True)
 
     x, z, zm = [Function(space) for i in range(3)]
     if (ssize>1):
         zstd = Function(space)
     if (sample_posterior):
-        a, am = [Function(space) for i in range(2)]
-        if (ssize>1):
+        am = Function(space)
+        if (ssize > 1):
             astd = Function(space)
 
     shp = np.shape(z.vector().get_local())
@@ -163,8 +107,6 @@ def run_sample(config_file):
     if (sample_posterior):
         am.vector().zero()
         am.vector().apply("insert")
-        y.vector().zero()
-        y.vector().apply("insert")
         if (ssize>1):
             astd.vector().zero()
             astd.vector().apply("insert")
@@ -175,8 +117,12 @@ def run_sample(config_file):
         x.vector().set_local(random.normal(np.zeros(shp),  # N
                          np.ones(shp),shp))
         x.vector().apply("insert")
-	  
-        reg_op.sqrt_inv_action(x.vector(),z.vector())  # Gamma 1/2 N
+
+        if (sample_posterior):
+            # prior & posterior samples from the same noise
+            z, a = post_cov.sample(x)
+        else:
+            reg_op.sqrt_inv_action(x.vector(), z.vector())  # Gamma 1/2 N
 
         zm.vector().set_local(zm.vector().get_local() + z.vector().get_local()/float(ssize))
         zm.vector().apply("insert")
@@ -185,18 +131,6 @@ def run_sample(config_file):
             zstd.vector().apply("insert")
 
         if (sample_posterior):
-            reg_op.sqrt_action(x.vector(),y.vector())  # Gamma -1/2 N
-
-            tmp1 = np.asarray([w.vector().inner(y.vector()) for w in W])
-            tmp2 = np.dot(D,tmp1)
-
-            P1 = Function(space)
-            for ind in range(len(tmp2)):
-                P1.vector().axpy(tmp2[ind],W[ind].vector())
-
-            a.vector().set_local(z.vector().get_local() + P1.vector())
-            a.vector().apply("insert")
-
             am.vector().set_local(am.vector().get_local() + a.vector().get_local()/float(ssize))
             am.vector().apply("insert")
             if (ssize>1):
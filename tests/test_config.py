@@ -43,6 +43,57 @@ def test_parse_config(temp_model):
     return params
 
 
+@pytest.mark.short
+def test_time_config_adaptive():
+    """Test the defaults & bounds of adaptive time stepping configuration"""
+    time_cfg = config.TimeCfg(run_length=10.0, dt=0.5, adaptive_dt=True)
+    assert time_cfg.total_steps == 20
+    assert time_cfg.dt_min == 0.5 / 16.0
+    assert time_cfg.dt_max == 0.5 * 16.0
+
+    with pytest.raises(AssertionError):
+        config.TimeCfg(run_length=10.0, dt=0.5, adaptive_dt=True, dt_max=0.25)
+
+
+@pytest.mark.short
+def test_adaptive_multistage_config(temp_model):
+    """Test that adaptive time stepping rejects multistage checkpointing"""
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    params = config.ConfigParser(work_dir/toml_file, work_dir)
+    params.config_dict['time']['adaptive_dt'] = True
+    params.config_dict['checkpointing'] = {"method": "multistage",
+                                           "snaps_on_disk": 2,
+                                           "snaps_in_ram": 2}
+    with pytest.raises(AssertionError):
+        params.parse()
+
+    params.config_dict['checkpointing'] = {"method": "memory"}
+    params.parse()
+    assert params.time.adaptive_dt
+
+
+@pytest.mark.short
+def test_eigendec_config_random():
+    """Test the requirements of the randomised eigendecomposition config"""
+    eig_cfg = config.EigenDecCfg(num_eig=10, eig_algo="random")
+    assert eig_cfg.oversampling == 10
+
+    with pytest.raises(AssertionError):
+        config.EigenDecCfg(eig_algo="random")
+
+
+@pytest.mark.short
+def test_eigendec_config_validation():
+    """Test the eigenvector validation policy config"""
+    eig_cfg = config.EigenDecCfg()
+    assert eig_cfg.ev_validation == "all"
+
+    with pytest.raises(AssertionError):
+        config.EigenDecCfg(ev_validation="checksum")
+
+
 ###################
 #     INOUT       #
 ###################
@@ -0,0 +1,208 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+from fenics_ice.backend import Function, FunctionSpace, HDF5File, \
+    TestFunction, TrialFunction, UnitSquareMesh, assemble, dx, \
+    function_get_values, function_set_values, inner
+
+import pytest
+import numpy as np
+from types import SimpleNamespace
+import mpi4py.MPI as MPI  # noqa: N817
+from fenics_ice.eigenbasis import EigenBasis, StreamedEigenBasis
+
+
+def random_basis(k, seed=1234):
+    """An EigenBasis of k random vectors in a small P1 space"""
+    comm = MPI.COMM_WORLD
+    mesh = UnitSquareMesh(comm, 6, 6)
+    space = FunctionSpace(mesh, "Lagrange", 1)
+    n_local = function_get_values(Function(space)).shape[0]
+
+    rng = np.random.default_rng([seed, comm.rank])
+    return EigenBasis(space, rng.standard_normal((k, n_local)))
+
+
+def random_functions(space, m, seed=5678):
+    """m random functions in space"""
+    rng = np.random.default_rng([seed, MPI.COMM_WORLD.rank])
+    X = []
+    for j in range(m):
+        x = Function(space)
+        function_set_values(
+            x, rng.standard_normal(function_get_values(x).shape[0]))
+        X.append(x)
+    return X
+
+
+@pytest.mark.short
+def test_eigen_basis_products():
+    """
+    Compare the block products of EigenBasis with per-vector inner products
+    & axpys
+    """
+    k, m = 7, 3
+    basis = random_basis(k)
+    W = [basis.function(i) for i in range(k)]
+    X = random_functions(basis.space, m)
+    X_values = np.array([function_get_values(x) for x in X])
+
+    # W^T X
+    WtX_ref = np.array([[w.vector().inner(x.vector()) for x in X] for w in W])
+    assert np.allclose(basis.inner_block(X_values), WtX_ref,
+                       rtol=1.0e-12, atol=1.0e-12)
+    assert np.allclose(basis.inner(X[0]), WtX_ref[:, 0],
+                       rtol=1.0e-12, atol=1.0e-12)
+    assert np.allclose(basis.inner(X[1].vector()), WtX_ref[:, 1],
+                       rtol=1.0e-12, atol=1.0e-12)
+
+    # W c
+    c = np.arange(1.0, k + 1.0)
+    y_ref = Function(basis.space)
+    for c_i, w in zip(c, W):
+        y_ref.vector().axpy(c_i, w.vector())
+    y = basis.combine(c)
+    assert np.allclose(function_get_values(y), function_get_values(y_ref),
+                       rtol=1.0e-12, atol=1.0e-12)
+
+    # W^T X and W diag(d) W^T X
+    d = np.linspace(0.5, 2.0, k)
+    WtX, Y = basis.weighted_projection_block(X_values, d)
+    assert np.allclose(WtX, WtX_ref, rtol=1.0e-12, atol=1.0e-12)
+    for j in range(m):
+        y_ref = Function(basis.space)
+        for i, w in enumerate(W):
+            y_ref.vector().axpy(d[i] * WtX_ref[i, j], w.vector())
+        assert np.allclose(Y[j, :], function_get_values(y_ref),
+                           rtol=1.0e-12, atol=1.0e-12)
+
+    # l2 norms & subsets
+    assert np.allclose(basis.l2_norms(), [w.vector().norm("l2") for w in W],
+                       rtol=1.0e-12, atol=0.0)
+    indices = [4, 1, 2]
+    subset = basis.subset(indices)
+    assert len(subset) == len(indices)
+    assert np.allclose(subset.inner_block(X_values), WtX_ref[indices, :],
+                       rtol=1.0e-12, atol=1.0e-12)
+
+
+@pytest.mark.short
+def test_eigen_basis_validation():
+    """Test the 'all', 'sample' & 'table' eigenvector validation policies"""
+    k = 7
+    basis = random_basis(k)
+    space = basis.space
+    M = assemble(inner(TestFunction(space), TrialFunction(space)) * dx)
+
+    n_actions = 0
+
+    def action(x, y):
+        nonlocal n_actions
+        n_actions += 1
+        M.mult(x, y)
+
+    reg_op = SimpleNamespace(action=action)
+
+    # Unit norm in the 'prior' M
+    values = basis.values.copy()
+    for i in range(k):
+        w = basis.function(i)
+        values[i, :] /= np.sqrt(w.vector().inner(M * w.vector()))
+    basis = EigenBasis(space, values)
+    norms = basis.l2_norms()
+
+    n_actions = 0
+    basis.validate(reg_op, 1.0e-10, validation="all")
+    assert n_actions == k
+
+    n_actions = 0
+    basis.validate(reg_op, 1.0e-10, validation="sample", n_samples=3)
+    assert n_actions == 3
+
+    n_actions = 0
+    basis.validate(reg_op, 1.0e-10, validation="table", norms=norms)
+    assert n_actions == 0
+
+    # No table: validates a sample
+    n_actions = 0
+    basis.validate(reg_op, 1.0e-10, validation="table", n_samples=3)
+    assert n_actions == 3
+
+    # One eigenvector not normalised
+    values = values.copy()
+    values[5, :] *= 2.0
+    bad_basis = EigenBasis(space, values)
+    with pytest.raises(AssertionError):
+        bad_basis.validate(reg_op, 1.0e-10, validation="all")
+    with pytest.raises(AssertionError):
+        bad_basis.validate(reg_op, 1.0e-10, validation="sample",
+                           n_samples=k)
+    with pytest.raises(AssertionError):
+        bad_basis.validate(reg_op, 1.0e-10, validation="table", norms=norms)
+    with pytest.raises(AssertionError):
+        basis.validate(reg_op, 1.0e-10, validation="table",
+                       norms=norms[:k - 1])
+
+
+@pytest.mark.short
+@pytest.mark.parametrize("block_size", [1, 3, 16])
+def test_streamed_eigen_basis(tmp_path, block_size):
+    """Compare StreamedEigenBasis with EigenBasis"""
+    k, m = 7, 3
+    basis = random_basis(k)
+    space = basis.space
+    comm = MPI.COMM_WORLD
+
+    filepath = comm.bcast(str(tmp_path / "vr.h5"), root=0)
+    with HDF5File(comm, filepath, 'w') as ev_file:
+        for i in range(k):
+            ev_file.write(basis.function(i), 'v', i)
+
+    X = random_functions(space, m)
+    X_values = np.array([function_get_values(x) for x in X])
+    c = np.arange(1.0, k + 1.0)
+    d = np.linspace(0.5, 2.0, k)
+
+    def check(streamed, basis):
+        n = len(basis)
+        assert len(streamed) == n
+        assert np.allclose(streamed.inner_block(X_values),
+                           basis.inner_block(X_values),
+                           rtol=1.0e-12, atol=1.0e-12)
+        assert np.allclose(function_get_values(streamed.combine(c[:n])),
+                           function_get_values(basis.combine(c[:n])),
+                           rtol=1.0e-12, atol=1.0e-12)
+        for Z_s, Z in zip(streamed.weighted_projection_block(X_values, d[:n]),
+                          basis.weighted_projection_block(X_values, d[:n])):
+            assert np.allclose(Z_s, Z, rtol=1.0e-12, atol=1.0e-12)
+        assert np.allclose(streamed.l2_norms(), basis.l2_norms(),
+                           rtol=1.0e-12, atol=0.0)
+        for i in range(n):
+            assert np.array_equal(function_get_values(streamed.function(i)),
+                                  function_get_values(basis.function(i)))
+
+    streamed = StreamedEigenBasis(space, filepath, np.arange(k), block_size)
+    check(streamed, basis)
+    indices = [4, 1, 2, 6]
+    check(streamed.subset(indices), basis.subset(indices))
+
+    # Block size from the memory budget
+    n_local = X_values.shape[1]
+    memory_budget = comm.allreduce(block_size * 8 * n_local, op=MPI.MAX) / 2 ** 20
+    streamed = StreamedEigenBasis.from_file(space, filepath, k, memory_budget)
+    assert streamed.block_size == block_size
+    check(streamed, EigenBasis.from_file(space, filepath, k))
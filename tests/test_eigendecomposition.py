@@ -0,0 +1,105 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+from fenics_ice.backend import FunctionSpace, LUSolver, TestFunction, \
+    TrialFunction, UnitIntervalMesh, assemble, dx, function_get_values, \
+    grad, inner
+
+import pytest
+import numpy as np
+import scipy.linalg
+import mpi4py.MPI as MPI  # noqa: N817
+from fenics_ice.eigendecomposition import early_stop_reached, \
+    randomized_eigendecompose
+
+
+@pytest.mark.short
+@pytest.mark.parametrize("n_power_iter", [1, 2])
+def test_randomized_eigendecompose(n_power_iter):
+    """
+    Compare randomized_eigendecompose with scipy.linalg.eigh for a small dense
+    generalised eigenproblem with a rapidly decaying spectrum
+    """
+    # Serial on each process, so that the dense matrices are complete
+    mesh = UnitIntervalMesh(MPI.COMM_SELF, 20)
+    space = FunctionSpace(mesh, "Lagrange", 1)
+    test, trial = TestFunction(space), TrialFunction(space)
+
+    M = assemble(inner(test, trial) * dx)
+    M_dense = M.array()
+    K_dense = assemble(inner(grad(test), grad(trial)) * dx
+                       + inner(test, trial) * dx).array()
+
+    # A with B = M eigenvalues 1, 0.1, 0.01, ...
+    _, U = scipy.linalg.eigh(K_dense, M_dense)
+    lam_exact = 10.0 ** -np.arange(U.shape[1], dtype=np.float64)
+    A_dense = M_dense @ U @ np.diag(lam_exact) @ U.T @ M_dense
+
+    lam_ref, vr_ref = scipy.linalg.eigh(A_dense, M_dense)
+    lam_ref, vr_ref = lam_ref[::-1], vr_ref[:, ::-1]
+
+    def A_action(X):
+        return [A_dense @ function_get_values(x) for x in X]
+
+    M_solver = LUSolver(M, "default")
+
+    def B_inv_action(x, y):
+        M_solver.solve(y, x)
+
+    n_eig = 5
+    lam, vr = randomized_eigendecompose(
+        space, A_action, M.mult, B_inv_action, n_eig,
+        oversampling=10, n_power_iter=n_power_iter, seed=1234)
+    V = np.array([function_get_values(v) for v in vr]).T
+
+    assert len(lam) == n_eig and len(vr) == n_eig
+    assert np.allclose(lam, lam_ref[:n_eig], rtol=1.0e-8, atol=0.0)
+
+    # B-orthonormal eigenvectors
+    assert np.allclose(V.T @ M_dense @ V, np.eye(n_eig), rtol=0.0,
+                       atol=1.0e-10)
+    assert np.allclose(A_dense @ V, M_dense @ V * lam, rtol=0.0,
+                       atol=1.0e-8)
+
+    # Matching the reference eigenvectors, up to sign
+    assert np.allclose(np.abs(vr_ref[:, :n_eig].T @ M_dense @ V),
+                       np.eye(n_eig), rtol=0.0, atol=1.0e-6)
+
+
+@pytest.mark.short
+def test_early_stop_reached():
+    """Test the eigenvalue threshold & trace_rtol early stopping criteria"""
+    lam = np.array([1.0e3, 1.0e2, 1.0e-3])
+
+    # No eigenvalues, or no criteria
+    assert not early_stop_reached(np.array([]), eigenvalue_thresh=1.0,
+                                  trace_rtol=1.0)
+    assert not early_stop_reached(lam)
+
+    # Eigenvalue threshold
+    assert early_stop_reached(lam, eigenvalue_thresh=1.0e-2)
+    assert not early_stop_reached(lam, eigenvalue_thresh=1.0e-4)
+
+    # Relative contribution to the variance reduction: here ~ 1.0e-3 / 2
+    assert early_stop_reached(lam, trace_rtol=1.0e-3)
+    assert not early_stop_reached(lam, trace_rtol=1.0e-4)
+    assert early_stop_reached(np.array([1.0, -0.1]), trace_rtol=1.0e-8)
+
+    # Either criterion suffices
+    assert early_stop_reached(lam, eigenvalue_thresh=1.0e-4, trace_rtol=1.0e-3)
+    assert not early_stop_reached(lam, eigenvalue_thresh=1.0e-4,
+                                  trace_rtol=1.0e-4)
@@ -17,10 +17,14 @@
 
 # -*- coding: utf-8 -*-
 
-from fenics_ice.backend import Function, function_update_state, norm
+from fenics_ice.backend import Function, Functional, clear_caches, \
+    compute_gradient, function_get_values, function_set_values, \
+    function_update_state, norm, reset_manager, start_manager, stop_manager, \
+    taylor_test
 
 import pytest
 import os
+from types import SimpleNamespace
 import numpy as np
 import fenics_ice as fice
 from fenics_ice import model, config, inout, solver
@@ -227,7 +231,371 @@ def test_control_separation(request, setup_deps, temp_model):
     assert norm_as != norm_am
     assert norm_bs != norm_bm
 
-# Unused!
+
+def solve_velocity(work_dir, toml_file, **momsolve):
+    """
+    Solve for the velocity, overriding params.momsolve options, and return its
+    values & the momentum solve iteration counts
+    """
+    mdl = init_model(work_dir, toml_file)
+    for name, value in momsolve.items():
+        override_param(mdl.params.momsolve, name, value)
+    initialize_fields(mdl)
+    initialize_vel_obs(mdl)
+    mdl.gen_alpha()
+    slvr = solver.ssa_solver(mdl)
+
+    stop_manager()
+    slvr.forward(slvr.get_control())
+    return function_get_values(slvr.U), slvr.mom_iterations
+
+
+@pytest.mark.dependency()
+def test_adaptive_picard_mom_solve(request, setup_deps, temp_model,
+                                   monkeypatch):
+    """
+    Compare the adaptive Picard to Newton momentum solve, with a retry after a
+    failed Newton stage, with the default momentum solve
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    U_ref, _ = solve_velocity(work_dir, toml_file)
+
+    # Report the first Newton stage as failed
+    n_newton = 0
+    solve_newton = solver.MomentumNonlinearSolver.solve_newton
+
+    def failing_solve_newton(self, final):
+        nonlocal n_newton
+        n_newton += 1
+        its, converged = solve_newton(self, final)
+        return its, converged and n_newton > 1
+
+    monkeypatch.setattr(solver.MomentumNonlinearSolver, "solve_newton",
+                        failing_solve_newton)
+
+    U, its = solve_velocity(work_dir, toml_file, adaptive_picard=True,
+                            newton_retries=1)
+    assert n_newton == 2
+    assert its["picard"] > 0 and its["newton"] > 0
+    assert np.allclose(U, U_ref, rtol=1.0e-6,
+                       atol=1.0e-6 * np.abs(U_ref).max())
+
+
+@pytest.mark.dependency()
+def test_inexact_newton_mom_solve(request, setup_deps, temp_model):
+    """
+    Compare the inexact Newton (Eisenstat-Walker forcing) momentum solve with
+    the default momentum solve
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    U_ref, _ = solve_velocity(work_dir, toml_file)
+    U, its = solve_velocity(work_dir, toml_file, inexact_newton=True)
+    assert its["krylov"] > 0
+    assert np.allclose(U, U_ref, rtol=1.0e-6,
+                       atol=1.0e-6 * np.abs(U_ref).max())
+
+
+@pytest.mark.dependency()
+def test_lagged_preconditioner_mom_solve(request, setup_deps, temp_model):
+    """
+    Compare momentum solves with a lagged preconditioner, reused across
+    Newton iterations & solves, with the default momentum solve
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    U_ref, _ = solve_velocity(work_dir, toml_file)
+
+    mdl = init_model(work_dir, toml_file)
+    override_param(mdl.params.momsolve, "reuse_solver", True)
+    override_param(mdl.params.momsolve, "reuse_preconditioner", True)
+    initialize_fields(mdl)
+    initialize_vel_obs(mdl)
+    mdl.gen_alpha()
+    slvr = solver.ssa_solver(mdl)
+
+    stop_manager()
+    for i in range(2):
+        slvr.U.vector().zero()
+        function_update_state(slvr.U)
+        slvr.forward(slvr.get_control())
+        U = function_get_values(slvr.U)
+        assert np.allclose(U, U_ref, rtol=1.0e-6,
+                           atol=1.0e-6 * np.abs(U_ref).max())
+
+
+@pytest.mark.dependency()
+def test_warm_start_mom_solve(request, setup_deps, temp_model):
+    """
+    Check that warm starting the momentum solve from the velocity at nearby
+    controls reduces the Newton iterations, and gives the same velocity
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    mdl = init_model(work_dir, toml_file)
+    initialize_fields(mdl)
+    initialize_vel_obs(mdl)
+    mdl.gen_alpha()
+    slvr = solver.ssa_solver(mdl)
+
+    stop_manager()
+    m0 = slvr.get_control()
+    slvr.forward(m0)
+    U0 = slvr.U.copy(deepcopy=True)
+
+    # Perturbed controls
+    m1 = []
+    for m in m0:
+        m = m.copy(deepcopy=True)
+        function_set_values(m, 1.01 * function_get_values(m))
+        m1.append(m)
+
+    slvr.U.vector().zero()
+    function_update_state(slvr.U)
+    slvr.forward(m1)
+    cold_its = slvr.mom_iterations
+    U_cold = function_get_values(slvr.U)
+
+    slvr.U.assign(U0, annotate=False)
+    slvr.forward(m1, warm=True)
+    warm_its = slvr.mom_iterations
+    U_warm = function_get_values(slvr.U)
+
+    assert warm_its["newton"] < cold_its["newton"]
+    assert np.allclose(U_warm, U_cold, rtol=1.0e-6,
+                       atol=1.0e-6 * np.abs(U_cold).max())
+
+
+@pytest.mark.dependency()
+def test_hessian_block_action(request, setup_deps, temp_model):
+    """
+    Compare block Hessian actions with per-direction CachedHessian actions,
+    and check that the forward is not re-run
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    mdl = init_model(work_dir, toml_file)
+    initialize_fields(mdl)
+    initialize_vel_obs(mdl)
+    mdl.gen_alpha()
+    slvr = solver.ssa_solver(mdl)
+
+    cntrl = slvr.get_control()[0]
+    slvr.set_hessian_action(cntrl)
+
+    rng = np.random.default_rng(1234)
+    dms = []
+    for i in range(3):
+        dm = Function(cntrl.function_space())
+        function_set_values(
+            dm, rng.standard_normal(function_get_values(dm).shape[0]))
+        dms.append(dm)
+
+    n_mom_solves = 0
+    solve_mom_eq = slvr.solve_mom_eq
+
+    def counted_solve_mom_eq(*args, **kwargs):
+        nonlocal n_mom_solves
+        n_mom_solves += 1
+        return solve_mom_eq(*args, **kwargs)
+
+    slvr.solve_mom_eq = counted_solve_mom_eq
+    ddJ_vals = slvr.hessian_block_action(cntrl, dms)
+    assert n_mom_solves == 0
+    assert len(ddJ_vals) == len(dms)
+
+    for dm, ddJ_val in zip(dms, ddJ_vals):
+        _, _, ddJ_ref = slvr.ddJ.action(cntrl, dm)
+        ddJ_ref = function_get_values(ddJ_ref)
+        assert np.allclose(function_get_values(ddJ_val), ddJ_ref,
+                           rtol=1.0e-10, atol=1.0e-10 * np.abs(ddJ_ref).max())
+
+
+@pytest.mark.dependency()
+def test_thickness_solver_assembly(request, setup_deps, temp_model,
+                                   monkeypatch):
+    """
+    Check that ThicknessSolver only re-assembles its matrix when U_np or dt
+    change
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    mdl = init_model(work_dir, toml_file)
+    initialize_fields(mdl)
+    mdl.gen_alpha()
+    slvr = solver.ssa_solver(mdl)
+
+    stop_manager()
+    slvr.def_thickadv_eq()
+    thicksolver, _ = slvr.get_thicksolver()
+
+    n_assembles = 0
+    backend_assemble = solver.backend_assemble
+
+    def counted_backend_assemble(form, *args, **kwargs):
+        nonlocal n_assembles
+        if form is getattr(thicksolver, "_a", None):
+            n_assembles += 1
+        return backend_assemble(form, *args, **kwargs)
+
+    monkeypatch.setattr(solver, "backend_assemble", counted_backend_assemble)
+
+    for i in range(3):
+        thicksolver.solve()
+    assert n_assembles == 1
+
+    function_set_values(slvr.U_np, 1.01 * function_get_values(slvr.U_np))
+    for i in range(3):
+        thicksolver.solve()
+    assert n_assembles == 2
+
+    slvr.dt.assign(0.5 * float(slvr.dt))
+    for i in range(3):
+        thicksolver.solve()
+    assert n_assembles == 3
+
+
+@pytest.mark.dependency()
+def test_thickness_solve(request, setup_deps, temp_model):
+    """
+    Compare the cached (reuse_solver) & explicit thickness solves with the
+    default thickness solve, over one short time step
+    """
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    def solve_thickness(**mass_solve):
+        """The change in thickness over one step, with params.mass_solve options"""
+        mdl = init_model(work_dir, toml_file)
+        for name, value in mass_solve.items():
+            override_param(mdl.params.mass_solve, name, value)
+        initialize_fields(mdl)
+        initialize_vel_obs(mdl)
+        mdl.gen_alpha()
+        slvr = solver.ssa_solver(mdl)
+
+        stop_manager()
+        slvr.def_thickadv_eq()
+        slvr.def_mom_eq()
+        slvr.solve_mom_eq()
+        slvr.U_np.assign(slvr.U)
+
+        H0 = function_get_values(slvr.H_np)
+        slvr.solve_thickadv_eq(1.0e-3 * mdl.params.time.dt)
+        return function_get_values(slvr.H) - H0
+
+    dH_ref = solve_thickness()
+    atol = np.abs(dH_ref).max()
+    assert atol > 0.0
+
+    dH = solve_thickness(reuse_solver=True)
+    assert np.allclose(dH, dH_ref, rtol=0.0, atol=1.0e-10 * atol)
+
+    # Forward (rather than backward) Euler: first order agreement in dt
+    dH = solve_thickness(explicit_thickness=True)
+    assert np.allclose(dH, dH_ref, rtol=0.0, atol=1.0e-2 * atol)
+
+
+@pytest.mark.dependency()
+def test_J_reg_taylor(request, setup_deps, temp_model):
+    """Taylor verification of the gradient of the regularisation term J_reg"""
+    setup_deps.set_case_dependency(request, ["test_init_model",
+                                             "test_initialize_fields"])
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    mdl = init_model(work_dir, toml_file)
+    initialize_fields(mdl)
+    mdl.gen_alpha()
+    slvr = solver.ssa_solver(mdl)
+    lap = slvr.get_prior()
+
+    def forward(alpha, beta):
+        J_reg_alpha, J_reg_beta = lap.J_reg(alpha=alpha, beta=beta,
+                                            beta_diff=beta - slvr.beta_bgd)
+        J = Functional(name="J")
+        for J_reg_term in [J_reg_alpha, J_reg_beta]:
+            if J_reg_term is not None:
+                J.addto(J_reg_term)
+        return J
+
+    cntrl = [slvr.alpha.copy(deepcopy=True), slvr.beta.copy(deepcopy=True)]
+
+    reset_manager("memory", {})
+    clear_caches()
+    start_manager()
+    J = forward(*cntrl)
+    stop_manager()
+    dJ = compute_gradient(J, cntrl)
+
+    min_order = taylor_test(forward, cntrl, J_val=J.value(), dJ=dJ,
+                            seed=1.0e-2)
+    assert min_order > 1.99
+
+
+@pytest.mark.short
+def test_adaptive_timestep_times():
+    """
+    Check that CFL-adaptive time steps are quantised & bounded, and land
+    exactly on the sensitivity/output times
+    """
+    time_cfg = config.TimeCfg(run_length=10.0, dt=0.5, adaptive_dt=True,
+                              cfl=0.5)
+    rates = iter([0.3, 0.0, 50.0, 0.05, 1.0, 0.2] * 100)
+    slvr = SimpleNamespace(params=SimpleNamespace(time=time_cfg),
+                           thickadv_cfl_rate=lambda: next(rates))
+    slvr.cfl_dt = lambda: solver.ssa_solver.cfl_dt(slvr)
+
+    # dt * 2**k, from the CFL condition & within [dt_min, dt_max]
+    assert slvr.cfl_dt() == 1.0
+    assert slvr.cfl_dt() == time_cfg.dt_max
+    assert slvr.cfl_dt() == time_cfg.dt_min
+    assert slvr.cfl_dt() == 8.0
+
+    t_events = np.array([1.3, 5.0, 2.0 / 3.0 * 10.0, 10.0])
+    t_prev = 0.0
+    t_steps = []
+    for t, dt in solver.ssa_solver.timestep_times(slvr, np.sort(t_events)):
+        assert 0.0 < dt <= time_cfg.dt_max
+        assert np.isclose(t - t_prev, dt, rtol=1.0e-12, atol=0.0)
+        t_prev = t
+        t_steps.append(t)
+
+    # Exactly on each event, ending at run_length
+    assert set(t_events).issubset(t_steps)
+    assert t_steps[-1] == time_cfg.run_length
+    assert np.all(np.diff(t_steps) > 0.0)
+
+    # Fixed time stepping is unchanged
+    time_cfg = config.TimeCfg(run_length=10.0, dt=0.5)
+    slvr = SimpleNamespace(params=SimpleNamespace(time=time_cfg))
+    steps = list(solver.ssa_solver.timestep_times(slvr, t_events))
+    assert len(steps) == time_cfg.total_steps
+    assert all(dt == 0.5 for _, dt in steps)
+    assert steps[-1][0] == time_cfg.run_length
+
+
 def override_param(param_section, name, value):
     """Override frozen ConfigParser params for testing"""
     try:
@@ -0,0 +1,58 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+from fenics_ice.backend import Point, RectangleMesh
+
+import pytest
+import numpy as np
+import mpi4py.MPI as MPI  # noqa: N817
+from fenics_ice.point_location import locate_points, point_locator
+
+
+@pytest.mark.short
+def test_locate_points():
+    """Compare locate_points with the DOLFIN bounding box tree"""
+    comm = MPI.COMM_WORLD
+    mesh = RectangleMesh(comm, Point(0.0, 0.0), Point(3.0, 2.0), 12, 8)
+    n_owned = mesh.topology().ghost_offset(mesh.topology().dim())
+
+    # Identical on all processes, some outside the mesh
+    rng = np.random.default_rng(1234)
+    x_coords = rng.uniform([-0.5, -0.5], [3.5, 2.5], size=(500, 2))
+
+    bbt = mesh.bounding_box_tree()
+    expected_cells = np.full(x_coords.shape[0], -1, dtype=np.int64)
+    for i, x in enumerate(x_coords):
+        cell = bbt.compute_first_entity_collision(Point(*x))
+        if cell < n_owned:
+            expected_cells[i] = cell
+
+    # No ghost cells in the index
+    y_cells = point_locator(mesh).locate(x_coords)
+    assert np.all(y_cells < n_owned)
+    assert np.array_equal(y_cells, expected_cells)
+
+    y_cells, x_local, x_global = locate_points(x_coords, mesh, comm)
+    inside = np.all((x_coords >= 0.0) & (x_coords <= [3.0, 2.0]), axis=1)
+    assert np.array_equal(x_global, inside)
+    assert np.array_equal(y_cells >= 0, x_local)
+    assert np.array_equal(y_cells[x_local], expected_cells[x_local])
+
+    # Each point in the mesh is owned by exactly one process
+    n_owners = np.empty(x_coords.shape[0], dtype=np.int64)
+    comm.Allreduce(x_local.astype(np.int64), n_owners, op=MPI.SUM)
+    assert np.array_equal(n_owners, inside.astype(np.int64))